@@ -184,7 +184,8 @@ def save(data_object, filename, **options):
     """Writes data object to specified file.
 
     :param data_object: GaiaDataObject instance
-    :param filename: filesystem path
+    :param filename: filesystem path, or postgresql:// database URL to
+      write vector data to the table given by a table option
     :param options: options to pass to writing backend
     :return boolean indicating success
     """
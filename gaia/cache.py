@@ -0,0 +1,192 @@
+from __future__ import absolute_import, division, print_function
+from builtins import (
+    bytes, str, open, super, range, zip, round, input, int, pow, object
+)
+
+import hashlib
+import json
+import logging
+import os
+
+from six import string_types
+
+import gaia.types as types
+
+logger = logging.getLogger('gaia.cache')
+
+#: File extension of cached results, by data type
+CACHE_EXTENSIONS = {
+    types.VECTOR: '.parquet',
+    types.RASTER: '.tif'
+}
+
+#: Result caches by (directory, maximum size)
+_caches = {}
+
+
+def get_result_cache():
+    """
+    Return the result cache configured by the cache_dir and cache_size_mb
+    settings of the [gaia] configuration section, or None when cache_dir
+    is not set.
+
+    :return: ResultCache or None
+    """
+    import gaia
+    settings = gaia.get_config().get('gaia', {})
+    directory = settings.get('cache_dir')
+    if not directory:
+        return None
+    max_size = int(float(settings.get('cache_size_mb') or 1024) * 2 ** 20)
+    if (directory, max_size) not in _caches:
+        _caches[(directory, max_size)] = ResultCache(directory, max_size)
+    return _caches[(directory, max_size)]
+
+
+def fingerprint(data_object):
+    """
+    Identify the content of a data object without reading it.
+
+    Data read from a file is identified by the path, modification time
+    and size of the file and the reader's options, and data computed or
+    reprojected while the cache is enabled by the cache key it was
+    computed for.  Data otherwise set or replaced since it was read
+    cannot be identified.
+
+    :param data_object: GaiaDataObject
+    :return: JSON-serializable fingerprint, None if the content cannot
+    be identified
+    """
+    key = getattr(data_object, '_fingerprint', None)
+    if key is not None:
+        return key
+    if getattr(data_object, '_dirty', False):
+        return None
+
+    reader = data_object._reader
+    uri = getattr(reader, 'uri', None)
+    if not isinstance(uri, string_types) or not os.path.isfile(uri):
+        return None
+    stat = os.stat(uri)
+    options = dict((name, getattr(reader, name)) for name in
+                   ('epsg', 'columns', 'bbox', 'chunk_size')
+                   if getattr(reader, name, None) is not None)
+    return [os.path.abspath(uri), stat.st_mtime, stat.st_size, options]
+
+
+class ResultCache(object):
+    """
+    Content-addressed on-disk cache of process results.
+
+    Results are stored under a hash of the process name, the fingerprints
+    of the inputs and the arguments: vector data as GeoParquet and raster
+    data as Cloud-Optimized GeoTIFF.  When the files take more than
+    max_size bytes, the least recently used ones are removed.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, process_name, inputs, args):
+        """
+        Compute the cache key of a process run.
+
+        :param process_name: name of the process
+        :param inputs: list of GaiaDataObject inputs
+        :param args: dict of process arguments
+        :return: hex digest, None if an input cannot be fingerprinted
+        """
+        fingerprints = []
+        for data_object in inputs:
+            data_fingerprint = fingerprint(data_object)
+            if data_fingerprint is None:
+                return None
+            fingerprints.append(data_fingerprint)
+        content = json.dumps([process_name, fingerprints, args],
+                             sort_keys=True, default=repr)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def extensions():
+        """
+        Return the file extensions of the data types that can be cached,
+        GeoParquet (vector data) requiring pyarrow.
+
+        :return: dict of file extensions by data type
+        """
+        from gaia.io.geoparquet_reader import IS_PYARROW_LOADED
+        if IS_PYARROW_LOADED:
+            return CACHE_EXTENSIONS
+        return dict((datatype, ext) for datatype, ext in
+                    CACHE_EXTENSIONS.items() if ext != '.parquet')
+
+    def get(self, key):
+        """
+        Return the cached result of a key, or None.
+
+        :param key: cache key
+        :return: GaiaDataObject or None
+        """
+        import gaia
+        for ext in self.extensions().values():
+            path = os.path.join(self.directory, key + ext)
+            if os.path.exists(path):
+                # The modification time orders the entries for eviction
+                os.utime(path, None)
+                logger.debug('Result cache hit {}'.format(key))
+                return gaia.create(path)
+        return None
+
+    def put(self, key, data_object):
+        """
+        Store a result, if it is vector or raster data (vector data
+        requires pyarrow).
+
+        :param key: cache key
+        :param data_object: GaiaDataObject result
+        """
+        from gaia.io.writers import write_gaia_object
+        ext = self.extensions().get(data_object._getdatatype())
+        if ext is None:
+            return
+        path = os.path.join(self.directory, key + ext)
+        tmp_path = os.path.join(
+            self.directory, '{}.{}.tmp{}'.format(key, os.getpid(), ext))
+        options = {'cog': True} if ext == '.tif' else {}
+        try:
+            write_gaia_object(data_object, tmp_path, **options)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        its maximum size.  The temporary files of results being stored
+        are not entries.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if ('.tmp.' in name or
+                    os.path.splitext(name)[1] not in CACHE_EXTENSIONS.values()):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted by another process meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -18,6 +18,8 @@
 ###############################################################################
 import operator
 
+from shapely.geometry import shape
+
 #: Dict of mathematical operators for equations
 ops = {
     "=": operator.eq,
@@ -28,6 +30,15 @@ ops = {
     "<=": operator.le,
 }
 
+#: Dict of SQL templates for spatial filter operators, which compare
+#: a geometry column to a geometry
+spatial_ops = {
+    "&&": '"{column}" && {geometry}',
+    "within": 'ST_Within("{column}", {geometry})',
+    "intersects": 'ST_Intersects("{column}", {geometry})',
+    "dwithin": 'ST_DWithin("{column}", {geometry}, %s)',
+}
+
 
 def filter_pandas(df, filters):
     r"""
@@ -56,14 +67,26 @@ def filter_pandas(df, filters):
     return df
 
 
-def filter_postgis(filters):
+def filter_postgis(filters, srid=None, epsg=None, geom_column=None):
     r"""
     Generate a SQL statement to be used as a WHERE clause.
     TODO: Support parentheses?
 
+    Spatial operators (see spatial_ops) take a geometry column as attribute
+    and a shapely geometry or GeoJSON geometry as value, for example
+    [('the_geom', 'within', polygon)]. The '&&' (bounding box overlap)
+    operator also accepts a (minx, miny, maxx, maxy) bounding box, and
+    'dwithin' takes a (geometry, distance) pair, the distance being in
+    units of srid.
+
     :param filters: list of filters in the form of
     (attribute, operator, values [, join option (AND, OR)])\
     for example [('city', 'in', ['Boston', 'New York']), ('id', '>', 10)]
+    :param srid: SRID of the geometry columns
+    :param epsg: EPSG code of the filter geometries, if different from
+    srid they are transformed to it
+    :param geom_column: geometry column of spatial filters whose
+    attribute is None
     :return: SQL string and list of parameters
     """
     sql_filters = None
@@ -75,7 +98,22 @@ def filter_postgis(filters):
         values = filter[2]
         if len(filter) > 3:
             sql_joiner = filter[3]
-        if type(values) in (list, tuple):
+        if operator.lower() in spatial_ops:
+            distance = None
+            if operator.lower() == 'dwithin':
+                values, distance = values
+            envelope = (operator == '&&' and
+                        type(values) in (list, tuple) and len(values) == 4)
+            sql_filter = spatial_ops[operator.lower()].format(
+                column=attribute or geom_column,
+                geometry=postgis_geometry(srid, epsg, envelope))
+            if envelope:
+                sql_params.extend(values)
+            else:
+                sql_params.append(geometry_hex(values))
+            if distance is not None:
+                sql_params.append(distance)
+        elif type(values) in (list, tuple):
             sql_filter = '"{}" {} ('.format(attribute, operator) + ','.join(
                 ['%s' for x in values]) + ')'
             sql_params.extend(values)
@@ -87,3 +125,39 @@ def filter_postgis(filters):
         else:
             sql_filters = sql_filters + sql_joiner + sql_filter
     return sql_filters, sql_params
+
+
+def postgis_geometry(srid=None, epsg=None, envelope=False):
+    """
+    Generate the SQL expression of a geometry parameter passed as
+    hex-encoded WKB, or of a bounding box passed as four parameters.
+
+    :param srid: SRID the geometry must have in the query
+    :param epsg: EPSG code of the geometry, defaults to srid
+    :param envelope: the parameters are minx, miny, maxx, maxy
+    :return: SQL string with parameter placeholders
+    """
+    if envelope:
+        sql = 'ST_MakeEnvelope(%s, %s, %s, %s{})'
+    else:
+        sql = "ST_GeomFromWKB(decode(%s, 'hex'){})"
+    if epsg is None:
+        epsg = srid
+    if epsg is None:
+        return sql.format('')
+    sql = sql.format(', {}'.format(int(epsg)))
+    if srid is not None and int(srid) != int(epsg):
+        sql = 'ST_Transform({}, {})'.format(sql, int(srid))
+    return sql
+
+
+def geometry_hex(geometry):
+    """
+    Encode a shapely or GeoJSON geometry as hex WKB
+
+    :param geometry: shapely geometry or GeoJSON geometry mapping
+    :return: hex WKB string
+    """
+    if not hasattr(geometry, 'wkb_hex'):
+        geometry = shape(geometry)
+    return geometry.wkb_hex
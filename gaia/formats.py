@@ -29,8 +29,13 @@ JSON = ['.json', '.geojson']
 SHP = ['.shp']
 #: File extension for pandas dataframes
 PANDAS = ['pandas']
+#: File extensions for GeoParquet files
+PARQUET = ['.parquet', '.geoparquet']
+#: File extensions for Feather (Arrow IPC) files
+FEATHER = ['.feather', '.arrow']
 #: File extensions for all vector datasets
-VECTOR = list(itertools.chain.from_iterable([JSON, SHP, PANDAS]))
+VECTOR = list(itertools.chain.from_iterable(
+    [JSON, SHP, PANDAS, PARQUET, FEATHER]))
 #: File extensions for raster datasets
 GEOTIFF = ['.tif', '.tiff', '.geotif', '.geotiff']
 PNG = ['.png']
@@ -42,4 +47,5 @@ ALL = VECTOR + RASTER
 #: File extensions for text-based datasets
 TEXT = list(itertools.chain.from_iterable([JSON]))
 #: File extensions for bindary datasets
-BINARY = list(itertools.chain.from_iterable([RASTER, SHP]))
+BINARY = list(itertools.chain.from_iterable(
+    [RASTER, SHP, PARQUET, FEATHER]))
@@ -3,19 +3,50 @@ from builtins import (
     bytes, str, open, super, range, zip, round, input, int, pow, object
 )
 
-from sqlalchemy import create_engine, MetaData, Table, text
+import threading
+import time
+
+from sqlalchemy import MetaData, Table, text
 from geoalchemy2 import Geometry
 import fiona
 import geopandas
+from shapely.ops import unary_union
+from shapely.prepared import prep
 try:
     import osr
 except ImportError:
     from osgeo import osr
 
+from gaia.cache import get_result_cache
 from gaia.filters import filter_postgis
-from gaia.geo.gdal_functions import gdal_reproject
+from gaia.geo.gdal_functions import gdal_iter_tiles, gdal_reproject
 from gaia.util import GaiaException, sqlengines
 
+#: Reflected PostGIS table information, keyed by (database URL, table)
+table_info_cache = {}
+table_info_lock = threading.Lock()
+#: Locks serializing the reflection of each (database URL, table)
+table_info_locks = {}
+
+
+def _table_info_ttl():
+    import gaia
+    settings = gaia.get_config().get('gaia_postgis', {})
+    return float(settings.get('schema_cache_ttl') or 300)
+
+
+def _table_info_expired(info):
+    return info is None or time.time() - info['time'] > _table_info_ttl()
+
+
+def clear_table_info_cache():
+    """
+    Forget the reflected PostGIS table information, for instance after
+    altering tables.
+    """
+    with table_info_lock:
+        table_info_cache.clear()
+
 
 class GaiaDataObject(object):
     def __init__(self, reader=None, dataFormat=None, epsg=None, **kwargs):
@@ -25,10 +56,17 @@ class GaiaDataObject(object):
         self._datatype = None
         self._dataformat = dataFormat
         self._epsg = epsg
+        self._union_cache = {}
+        # Cache key of the result this data was computed as, if any
+        self._fingerprint = None
+        # Data set by other code than the reader, so that it may differ
+        # from the reader's source
+        self._dirty = False
+        self._loading = False
 
     def get_metadata(self):
         if not self._metadata:
-            self._reader.load_metadata(self)
+            self._load(self._reader.load_metadata)
         return self._metadata
 
     def set_metadata(self, metadata):
@@ -36,20 +74,152 @@ class GaiaDataObject(object):
 
     def get_data(self):
         if self._data is None:
-            self._reader.load_data(self)
+            self._load(self._reader.load_data)
         return self._data
 
     def set_data(self, data):
         self._data = data
+        self._union_cache = {}
+        if not self._loading:
+            self._dirty = True
+            self._fingerprint = None
+
+    def _load(self, load):
+        """
+        Call a reader's load method, the data it sets being the reader's
+        """
+        loading = self._loading
+        self._loading = True
+        try:
+            load(self)
+        finally:
+            self._loading = loading
 
     def get_epsg(self):
+        if self._epsg is None and self._data is None and not self._metadata:
+            # Readers set the EPSG code along with the metadata
+            self.get_metadata()
         return self._epsg
 
+    def get_container(self):
+        """
+        Return the type of the data, as declared by the reader when the
+        data is not loaded yet, so that it can be checked without loading
+        the data.
+        """
+        if self._data is not None:
+            return type(self._data)
+        container = getattr(self._reader, 'container', None)
+        if container is None:
+            return type(self.get_data())
+        return container
+
+    def get_chunk_size(self):
+        """
+        Return the number of features per chunk when the data is streamed
+        from its reader instead of being loaded at once, None otherwise.
+        """
+        if self._data is not None:
+            return None
+        return getattr(self._reader, 'chunk_size', None)
+
+    def iter_chunks(self, chunk_size=None, bbox=None):
+        """
+        Iterate over the data in chunks, without loading all of it when
+        the reader supports streaming.
+
+        Vector data comes as GeoDataFrames of chunk_size rows, raster data
+        as ((xoff, yoff, xsize, ysize), array) block windows.
+
+        :param chunk_size: number of features per chunk, or approximate
+        tile edge in pixels for rasters (default is the reader's chunk
+        size, or the whole data for vectors and one block for rasters)
+        :param bbox: (minx, miny, maxx, maxy) in the data's coordinates,
+        to only iterate over the data intersecting it
+        :return: generator of data chunks
+        """
+        if self._data is None and self._reader is not None:
+            chunks = self._reader.iter_chunks(self, chunk_size, bbox)
+        else:
+            chunks = self._iter_data_chunks(self.get_data(), chunk_size, bbox)
+        for chunk in chunks:
+            yield chunk
+
+    def _iter_data_chunks(self, data, chunk_size=None, bbox=None):
+        """
+        Split loaded data into chunks, see iter_chunks()
+        """
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            data = data.cx[minx:maxx, miny:maxy]
+        step = chunk_size or max(len(data), 1)
+        for start in range(0, max(len(data), 1), step):
+            yield data.iloc[start:start + step]
+
+    def get_unary_union(self, epsg=None):
+        """
+        Return the union of all the geometries in the data.
+
+        Unions are cached on the object per EPSG code, and the cache is
+        dropped whenever new data is set, so cropping many datasets
+        against the same object only dissolves its geometries once.
+
+        :param epsg: EPSG code of the union (default is the data's own)
+        :return: shapely geometry
+        """
+        return self._get_cached_union(epsg)[0]
+
+    def get_prepared_union(self, epsg=None):
+        """
+        Return the prepared form of get_unary_union(), for fast repeated
+        predicate tests.
+
+        :param epsg: EPSG code of the union (default is the data's own)
+        :return: shapely prepared geometry
+        """
+        entry = self._get_cached_union(epsg)
+        if entry[1] is None:
+            entry[1] = prep(entry[0])
+        return entry[1]
+
+    def _get_cached_union(self, epsg=None):
+        if epsg is not None and epsg in self._union_cache:
+            return self._union_cache[epsg]
+
+        own_epsg = self.get_epsg()
+        if epsg is None:
+            epsg = own_epsg
+        if own_epsg not in self._union_cache:
+            if self.get_chunk_size():
+                # Streamed data is dissolved one chunk at a time
+                union = unary_union([chunk.geometry.unary_union
+                                     for chunk in self.iter_chunks()])
+            else:
+                union = self.get_data().geometry.unary_union
+            self._union_cache[own_epsg] = [union, None]
+        if epsg not in self._union_cache:
+            # Only the union needs reprojecting, not the whole data
+            if self._data is not None:
+                crs = self._data.crs
+            else:
+                crs = fiona.crs.from_epsg(own_epsg)
+            union = geopandas.GeoSeries(
+                [self._union_cache[own_epsg][0]],
+                crs=crs).to_crs(epsg=epsg).iloc[0]
+            self._union_cache[epsg] = [union, None]
+        return self._union_cache[epsg]
+
     def reproject(self, epsg):
-        repro = geopandas.GeoDataFrame.copy(self.get_data())
-        repro[repro.geometry.name] = repro.geometry.to_crs(epsg=epsg)
-        repro.crs = fiona.crs.from_epsg(epsg)
-        self._data = repro
+        cache = get_result_cache()
+        key = cache.key('reproject', [self], {'epsg': epsg}) if cache else None
+        cached = cache.get(key) if key else None
+        if cached is not None:
+            repro = cached.get_data()
+        else:
+            repro = geopandas.GeoDataFrame.copy(self.get_data())
+            repro[repro.geometry.name] = repro.geometry.to_crs(epsg=epsg)
+            repro.crs = fiona.crs.from_epsg(epsg)
+        self.set_data(repro)
         self._epsg = epsg
 
         # Recompute bounds
@@ -65,7 +235,14 @@ class GaiaDataObject(object):
         metadata['bounds'] = bounds
         self.set_metadata(metadata)
 
+        if key:
+            if cached is None:
+                cache.put(key, self)
+            self._fingerprint = key
+
     def _getdatatype(self):
+        if not self._datatype:
+            self._datatype = getattr(self._reader, 'datatype', None)
         if not self._datatype:
             self.get_metadata()
             if not self._datatype:
@@ -98,7 +275,11 @@ class GDALDataObject(GaiaDataObject):
 
     def get_epsg(self):
         if not self._epsgComputed:
-            if not self._data:
+            if self._data is None:
+                # The header metadata has it, no need to open the data
+                epsg = self.get_metadata().get('epsg')
+                if epsg is not None:
+                    return epsg
                 self.get_data()
 
             projection = self._data.GetProjection()
@@ -113,9 +294,26 @@ class GDALDataObject(GaiaDataObject):
         return self.epsg
 
     def reproject(self, epsg):
-        self._data = gdal_reproject(self._data, '', epsg=epsg)
+        cache = get_result_cache()
+        key = cache.key('reproject', [self], {'epsg': epsg}) if cache else None
+        cached = cache.get(key) if key else None
+        if cached is not None:
+            self.set_data(cached.get_data())
+        else:
+            self.set_data(gdal_reproject(self.get_data(), '', epsg=epsg))
         self.epsg = epsg
 
+        if key:
+            if cached is None:
+                cache.put(key, self)
+            self._fingerprint = key
+
+    def _iter_data_chunks(self, data, chunk_size=None, bbox=None):
+        """
+        Read the raster in block windows, see iter_chunks()
+        """
+        return gdal_iter_tiles(data, chunk_size, bbox)
+
 
 class PostgisDataObject(GaiaDataObject):
     def __init__(self, reader=None, **kwargs):
@@ -134,6 +332,9 @@ class PostgisDataObject(GaiaDataObject):
         self._epsg = None
         self._meta = None
         self._table_obj = None
+        self._itersize = 2000
+        self._spatial_filters = None
+        self._filter_epsg = None
 
     # Define table property
     def _settable(self, table):
@@ -207,6 +408,26 @@ class PostgisDataObject(GaiaDataObject):
 
     geom_column = property(_getgeom_column, _setgeom_column)
 
+    # Define spatial_filters property, filters on the geometry column
+    # that rows must match in addition to filters
+    def _setspatial_filters(self, spatial_filters):
+        self._spatial_filters = spatial_filters
+
+    def _getspatial_filters(self):
+        return self._spatial_filters
+
+    spatial_filters = property(_getspatial_filters, _setspatial_filters)
+
+    # Define filter_epsg property, the EPSG code of the geometries in the
+    # filters when it differs from the table's
+    def _setfilter_epsg(self, filter_epsg):
+        self._filter_epsg = filter_epsg
+
+    def _getfilter_epsg(self):
+        return self._filter_epsg
+
+    filter_epsg = property(_getfilter_epsg, _setfilter_epsg)
+
     # Define engine property
     def _setengine(self, engine):
         self._engine = engine
@@ -216,8 +437,27 @@ class PostgisDataObject(GaiaDataObject):
 
     engine = property(_getengine, _setengine)
 
+    # Define itersize property, the number of rows fetched from the
+    # server at a time when streaming query results
+    def _setitersize(self, itersize):
+        self._itersize = int(itersize)
+
+    def _getitersize(self):
+        return self._itersize
+
+    itersize = property(_getitersize, _setitersize)
+
     # etc...
 
+    def get_chunk_size(self):
+        """
+        Tables not loaded yet are streamed in chunks of the reader's
+        chunk_size rows, or of itersize rows.
+        """
+        if self._data is not None:
+            return None
+        return getattr(self._reader, 'chunk_size', None) or self.itersize
+
     def initialize_engine(self):
         self._engine = self.get_engine(self.get_connection_string())
 
@@ -233,10 +473,7 @@ class PostgisDataObject(GaiaDataObject):
         :param connection_string: Database connection string
         :return: SQLAlchemy Engine object
         """
-        if connection_string not in sqlengines:
-            sqlengines[connection_string] = create_engine(
-                self.get_connection_string())
-        return sqlengines[connection_string]
+        return sqlengines.get_engine(connection_string)
 
     def verify(self):
         """
@@ -278,31 +515,67 @@ class PostgisDataObject(GaiaDataObject):
         Use SQLALchemy reflection to gather data on the table, including the
         geometry column, geometry type, and EPSG code, and assign to the
         PostgisIO object's attributes.
+
+        The reflected information is shared by all the objects reading the
+        same table of the same database, and reflected again once it is
+        older than the schema_cache_ttl setting (in seconds) of the
+        [gaia_postgis] configuration section.
         """
+        key = (str(self._engine.url), self._table)
+        with table_info_lock:
+            info = table_info_cache.get(key)
+            key_lock = table_info_locks.setdefault(key, threading.Lock())
+        if _table_info_expired(info):
+            # Only the objects reading the same table wait for the
+            # reflection, and then use its result
+            with key_lock:
+                with table_info_lock:
+                    info = table_info_cache.get(key)
+                if _table_info_expired(info):
+                    info = self._reflect_table()
+                    with table_info_lock:
+                        table_info_cache[key] = info
+
+        if not self._columns:
+            self._columns = list(info['columns'])
+        if info['geom_column'] is not None:
+            self._geom_column = info['geom_column']
+            if self._geom_column not in self._columns:
+                self._columns.append(self._geom_column)
+            if info['geometry_type'] is not None:
+                self._geometry_type = info['geometry_type']
+
+        self._epsg = info['epsg']
+        self._table_obj = info['table_obj']
+        self._meta = info['meta']
+
+    def _reflect_table(self):
         epsg = None
+        geom_column = None
+        geometry_type = None
         meta = MetaData()
         table_obj = Table(self._table, meta,
                           autoload=True, autoload_with=self._engine)
-        if not self._columns:
-            self._columns = table_obj.columns.keys()
         geo_cols = [(col.name, col.type) for col in table_obj.columns
                     if hasattr(col.type, 'srid')]
         if geo_cols:
-            geo_col = geo_cols[0]
-            self._geom_column = geo_col[0]
-            geo_obj = geo_col[1]
-            if self._geom_column not in self._columns:
-                self._columns.append(self._geom_column)
+            geom_column, geo_obj = geo_cols[0]
             if hasattr(geo_obj, 'srid'):
                 epsg = geo_obj.srid
                 if epsg == -1:
                     epsg = 4326
             if hasattr(geo_obj, 'geometry_type'):
-                self._geometry_type = geo_obj.geometry_type
-
-        self._epsg = epsg
-        self._table_obj = table_obj
-        self._meta = meta
+                geometry_type = geo_obj.geometry_type
+
+        return {
+            'time': time.time(),
+            'columns': table_obj.columns.keys(),
+            'geom_column': geom_column,
+            'geometry_type': geometry_type,
+            'epsg': epsg,
+            'table_obj': table_obj,
+            'meta': meta,
+        }
 
     def get_geometry_type(self):
         """
@@ -312,18 +585,37 @@ class PostgisDataObject(GaiaDataObject):
         """
         return self._geometry_type
 
-    def get_query(self):
+    def get_query(self, bbox=None, wkb=False):
         """
         Formulate a query string and parameter list based on the
         table name, columns, and filter
 
+        :param bbox: optional (minx, miny, maxx, maxy) the bounding boxes
+        of the geometries must intersect, in the table's coordinates
+        :param wkb: select the geometry column as binary WKB
         :return: Query string
         """
-        columns = ','.join(['"{}"'.format(x) for x in self._columns])
+        columns = ','.join([
+            'ST_AsBinary("{0}") AS "{0}"'.format(x)
+            if wkb and x == self._geom_column else '"{}"'.format(x)
+            for x in self._columns])
         query = 'SELECT {} FROM "{}"'.format(columns, self._table)
+        conditions = []
         filter_params = []
-        if self._filters:
-            filter_sql, filter_params = filter_postgis(self._filters)
-            query += ' WHERE {}'.format(filter_sql)
+        for filters, epsg in ((self._filters, self._filter_epsg),
+                              (self._spatial_filters, self._filter_epsg),
+                              (bbox is not None and [(None, '&&', bbox)],
+                               None)):
+            if filters:
+                filter_sql, params = filter_postgis(
+                    filters, srid=self._epsg, epsg=epsg,
+                    geom_column=self._geom_column)
+                conditions.append(filter_sql)
+                filter_params.extend(params)
+        if len(conditions) > 1:
+            # Filters may be joined with OR
+            conditions = ['({})'.format(c) for c in conditions]
+        if conditions:
+            query += ' WHERE {}'.format(' AND '.join(conditions))
         query += ';'
         return str(text(query)), filter_params
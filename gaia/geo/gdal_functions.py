@@ -16,15 +16,22 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 ###############################################################################
+import ast
 import re
 import string
 import os
 import json
 import logging
+import math
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
 import gdalconst
 import numpy
 import gdal
 import shapely
+import shapely.geometry
+import geopandas
 import rasterio
 import rasterio.features
 from gaia.util import (
@@ -38,10 +45,12 @@ except ImportError:
     from osgeo import gdalnumeric
 import ogr
 import osr
-from PIL import Image, ImageDraw
-from osgeo.gdal_array import BandReadAsArray, BandWriteArray
+from osgeo.gdal_array import (
+    BandReadAsArray,
+    BandWriteArray,
+    GDALTypeCodeToNumericTypeCode
+)
 import numpy as np
-from numpy.ma.core import MaskedConstant
 
 logger = logging.getLogger('gaia.geo.gdal_functions')
 
@@ -61,6 +70,10 @@ ndv_lookup = {
     'Float64': 1.7976931348623158E+308
 }
 
+#: Statistics computed by the zonal statistics functions by default,
+#: percentiles can also be requested as 'percentile_<q>'
+zonal_stats = ['count', 'sum', 'mean', 'median', 'min', 'max', 'stddev']
+
 # Map of file extensions to driver name
 driver_lookup = {
     'tif': 'GTiff',
@@ -201,7 +214,8 @@ def gdal_resize(raster, dimensions, projection, transform):
     return resized_ds
 
 
-def gdal_clip(raster_input, raster_output, polygon_json, nodata=0):
+def gdal_clip(raster_input, raster_output, polygon_json, nodata=0,
+              all_touched=False):
     """
     This function will subset a raster by a vector polygon.
     Adapted from the GDAL/OGR Python Cookbook at
@@ -211,31 +225,10 @@ def gdal_clip(raster_input, raster_output, polygon_json, nodata=0):
     :param raster_output: raster output filepath
     :param polygon_json: polygon as geojson string
     :param nodata: nodata value for output raster file
+    :param all_touched: keep every pixel touched by the polygon, not only
+    those whose center falls inside it
     :return: GDAL Dataset
     """
-
-    def image_to_array(i):
-        """
-        Converts a Python Imaging Library array to a
-        gdalnumeric image.
-        """
-        a = gdalnumeric.numpy.frombuffer(i.tobytes(), dtype='b')
-        a.shape = i.im.size[1], i.im.size[0]
-        return a
-
-    def world_to_pixel(geoMatrix, x, y):
-        """
-        Uses a gdal geomatrix (gdal.GetGeoTransform()) to calculate
-        the pixel location of a geospatial coordinate
-        """
-        ulX = geoMatrix[0]
-        ulY = geoMatrix[3]
-        xDist = geoMatrix[1]
-        yDist = geoMatrix[5]
-        pixel = int((x - ulX) / xDist)
-        line = int((y - ulY) / yDist)
-        return (pixel, line)
-
     src_image = get_dataset(raster_input)
     # Load the source data as a gdalnumeric array
     src_array = src_image.ReadAsArray()
@@ -244,28 +237,21 @@ def gdal_clip(raster_input, raster_output, polygon_json, nodata=0):
     # Also load as a gdal image to get geotransform
     # (world file) info
     geo_trans = src_image.GetGeoTransform()
-    nodata_values = []
-    for i in range(src_image.RasterCount):
-        nodata_value = src_image.GetRasterBand(i+1).GetNoDataValue()
-        if not nodata_value:
-            nodata_value = nodata
-        nodata_values.append(nodata_value)
+    nodata_values = _band_nodata_values(src_image, nodata)
 
     # Create an OGR layer from a boundary GeoJSON geometry string
-    if type(polygon_json) == dict:
-        polygon_json = json.dumps(polygon_json)
-    poly = ogr.CreateGeometryFromJson(polygon_json)
+    poly = _polygon_from_json(polygon_json)
 
     # Convert the layer extent to image pixel coordinates
     min_x, max_x, min_y, max_y = poly.GetEnvelope()
-    ul_x, ul_y = world_to_pixel(geo_trans, min_x, max_y)
-    lr_x, lr_y = world_to_pixel(geo_trans, max_x, min_y)
+    ul_x, ul_y = _world_to_pixel(geo_trans, min_x, max_y)
+    lr_x, lr_y = _world_to_pixel(geo_trans, max_x, min_y)
 
     # Calculate the pixel size of the new image
     px_width = int(lr_x - ul_x)
     px_height = int(lr_y - ul_y)
 
-    if raster_input.RasterCount == 1:
+    if src_image.RasterCount == 1:
         clip = src_array[ul_y:lr_y, ul_x:lr_x]
     else:
         clip = src_array[:, ul_y:lr_y, ul_x:lr_x]
@@ -274,50 +260,38 @@ def gdal_clip(raster_input, raster_output, polygon_json, nodata=0):
     xoffset = ul_x
     yoffset = ul_y
 
+    # Rasterize the polygon onto the clipped pixels, which start at the
+    # upper-left pixel corner rather than at the envelope corner
+    mask_trans = list(geo_trans)
+    mask_trans[0] = geo_trans[0] + ul_x * geo_trans[1]
+    mask_trans[3] = geo_trans[3] + ul_y * geo_trans[5]
+    mask = _polygon_mask(poly, mask_trans, px_width, px_height, all_touched)
+
     # Create a new geomatrix for the image
     geo_trans = list(geo_trans)
     geo_trans[0] = min_x
     geo_trans[3] = max_y
 
-    # Map points to pixels for drawing the
-    # boundary on a blank 8-bit,
-    # black and white, mask image.
-    raster_poly = Image.new("L", (px_width, px_height), 1)
-    rasterize = ImageDraw.Draw(raster_poly)
-    geometry_count = poly.GetGeometryCount()
-    for i in range(0, geometry_count):
-        points = []
-        pixels = []
-        pts = poly.GetGeometryRef(i)
-        if pts.GetPointCount() == 0:
-            pts = pts.GetGeometryRef(0)
-        for p in range(pts.GetPointCount()):
-            points.append((pts.GetX(p), pts.GetY(p)))
-        for p in points:
-            pixels.append(world_to_pixel(geo_trans, p[0], p[1]))
-        rasterize.polygon(pixels, 0)
-    mask = image_to_array(raster_poly)
-
     # Clip the image using the mask
-    if raster_input.RasterCount == 1:
-        clip = gdalnumeric.numpy.choose(
-            mask, (clip, nodata_value)).astype(src_dtype)
+    if src_image.RasterCount == 1:
+        clip = numpy.where(
+            mask, nodata_values[0], clip).astype(src_dtype)
     else:
-        for i in range(raster_input.RasterCount):
-            clip[i] = gdalnumeric.numpy.choose(
-                mask, (clip[i], nodata_value)).astype(src_dtype)
+        for i in range(src_image.RasterCount):
+            clip[i] = numpy.where(
+                mask, nodata_values[i], clip[i]).astype(src_dtype)
 
     # create output raster
-    raster_band = raster_input.GetRasterBand(1)
+    raster_band = src_image.GetRasterBand(1)
     output_driver = gdal.GetDriverByName('MEM')
     output_dataset = output_driver.Create(
         '', clip.shape[-1], clip.shape[-2],
-        raster_input.RasterCount, raster_band.DataType)
+        src_image.RasterCount, raster_band.DataType)
     output_dataset.SetGeoTransform(geo_trans)
-    output_dataset.SetProjection(raster_input.GetProjection())
-    gdalnumeric.CopyDatasetInfo(raster_input, output_dataset,
+    output_dataset.SetProjection(src_image.GetProjection())
+    gdalnumeric.CopyDatasetInfo(src_image, output_dataset,
                                 xoff=xoffset, yoff=yoffset)
-    bands = raster_input.RasterCount
+    bands = src_image.RasterCount
     if bands > 1:
         for i in range(bands):
             outBand = output_dataset.GetRasterBand(i + 1)
@@ -337,9 +311,179 @@ def gdal_clip(raster_input, raster_output, polygon_json, nodata=0):
     return output_dataset
 
 
+def gdal_clip_windowed(raster_input, raster_output, polygon_json, nodata=0,
+                       format='GTiff', all_touched=False):
+    """
+    Subset a raster by a vector polygon, reading only the source pixels
+    inside the polygon envelope.
+
+    Unlike gdal_clip, the source raster is never read as a whole: the
+    envelope window is copied one source block at a time straight into
+    the output dataset, so peak memory scales with the size of the crop
+    rather than with the size of the source.
+
+    :param raster_input: raster input filepath or GDAL Dataset
+    :param raster_output: raster output filepath, or None to create the
+    output in memory
+    :param polygon_json: polygon as geojson string
+    :param nodata: nodata value for bands without one
+    :param format: GDAL driver used to write raster_output
+    :param all_touched: keep every pixel touched by the polygon, not only
+    those whose center falls inside it
+    :return: GDAL Dataset
+    """
+    src_image = get_dataset(raster_input)
+    geo_trans = src_image.GetGeoTransform()
+    band_count = src_image.RasterCount
+    nodata_values = _band_nodata_values(src_image, nodata)
+
+    poly = _polygon_from_json(polygon_json)
+    xoff, yoff, xsize, ysize = _envelope_window(
+        geo_trans, poly.GetEnvelope(),
+        src_image.RasterXSize, src_image.RasterYSize)
+    if xsize <= 0 or ysize <= 0:
+        raise GaiaException('Clip polygon does not intersect the raster')
+
+    # Geotransform of the window, kept on the source pixel grid
+    out_trans = list(geo_trans)
+    out_trans[0] = geo_trans[0] + xoff * geo_trans[1] + yoff * geo_trans[2]
+    out_trans[3] = geo_trans[3] + xoff * geo_trans[4] + yoff * geo_trans[5]
+
+    # The mask only covers the window (True outside the polygon)
+    mask = _polygon_mask(poly, out_trans, xsize, ysize, all_touched)
+
+    # create output raster
+    if raster_output:
+        if os.path.isfile(raster_output):
+            os.remove(raster_output)
+        output_driver = gdal.GetDriverByName(format)
+    else:
+        output_driver = gdal.GetDriverByName('MEM')
+    output_dataset = output_driver.Create(
+        raster_output or '', xsize, ysize, band_count,
+        src_image.GetRasterBand(1).DataType)
+    output_dataset.SetGeoTransform(out_trans)
+    output_dataset.SetProjection(src_image.GetProjection())
+    output_dataset.SetMetadata(src_image.GetMetadata())
+    for i in range(band_count):
+        out_band = output_dataset.GetRasterBand(i + 1)
+        out_band.SetNoDataValue(nodata_values[i])
+        out_band.Fill(nodata_values[i])
+
+    # Copy the window block by block, skipping blocks outside the polygon
+    block_xsize, block_ysize = src_image.GetRasterBand(1).GetBlockSize()
+    for win_yoff, win_ysize in _block_ranges(yoff, ysize, block_ysize):
+        row = win_yoff - yoff
+        for win_xoff, win_xsize in _block_ranges(xoff, xsize, block_xsize):
+            col = win_xoff - xoff
+            block_mask = mask[row:row + win_ysize, col:col + win_xsize]
+            if block_mask.all():
+                continue
+            for i in range(band_count):
+                block = src_image.GetRasterBand(i + 1).ReadAsArray(
+                    win_xoff, win_yoff, win_xsize, win_ysize)
+                block[block_mask] = nodata_values[i]
+                output_dataset.GetRasterBand(i + 1).WriteArray(
+                    block, col, row)
+
+    output_dataset.FlushCache()
+    return output_dataset
+
+
+def _band_nodata_values(dataset, nodata):
+    """
+    Return the nodata value of each band of a dataset, substituting
+    the given default for bands that have none.
+    """
+    nodata_values = []
+    for i in range(dataset.RasterCount):
+        nodata_value = dataset.GetRasterBand(i + 1).GetNoDataValue()
+        if nodata_value is None:
+            nodata_value = nodata
+        nodata_values.append(nodata_value)
+    return nodata_values
+
+
+def _polygon_from_json(polygon_json):
+    """
+    Create an OGR geometry from a GeoJSON geometry string or dict
+    """
+    if type(polygon_json) == dict:
+        polygon_json = json.dumps(polygon_json)
+    return ogr.CreateGeometryFromJson(polygon_json)
+
+
+def _world_to_pixel(geo_trans, x, y):
+    """
+    Uses a gdal geomatrix (gdal.GetGeoTransform()) to calculate
+    the pixel location of a geospatial coordinate
+    """
+    pixel = int((x - geo_trans[0]) / geo_trans[1])
+    line = int((y - geo_trans[3]) / geo_trans[5])
+    return (pixel, line)
+
+
+def _envelope_window(geo_trans, envelope, raster_xsize, raster_ysize):
+    """
+    Convert an OGR envelope (min_x, max_x, min_y, max_y) to the pixel
+    window (xoff, yoff, xsize, ysize) covering it, clamped to the raster.
+    """
+    min_x, max_x, min_y, max_y = envelope
+    cols = sorted([(min_x - geo_trans[0]) / geo_trans[1],
+                   (max_x - geo_trans[0]) / geo_trans[1]])
+    rows = sorted([(max_y - geo_trans[3]) / geo_trans[5],
+                   (min_y - geo_trans[3]) / geo_trans[5]])
+    xoff = max(int(math.floor(cols[0])), 0)
+    yoff = max(int(math.floor(rows[0])), 0)
+    xend = min(int(math.ceil(cols[1])), raster_xsize)
+    yend = min(int(math.ceil(rows[1])), raster_ysize)
+    return xoff, yoff, xend - xoff, yend - yoff
+
+
+def _block_ranges(offset, size, block_size):
+    """
+    Split the pixel range [offset, offset + size) at multiples of
+    block_size, yielding (start, length) pairs aligned to the block grid.
+    """
+    end = offset + size
+    start = offset
+    while start < end:
+        stop = min((start // block_size + 1) * block_size, end)
+        yield start, stop - start
+        start = stop
+
+
+def _polygon_mask(poly, geo_trans, xsize, ysize, all_touched=False):
+    """
+    Rasterize a polygon onto a blank window of xsize by ysize pixels.
+
+    The polygon is burnt by GDAL into an in-memory byte band, so interior
+    rings (holes) and every part of a multipolygon are honoured.
+
+    :param poly: OGR polygon or multipolygon
+    :param geo_trans: geotransform of the window
+    :param all_touched: burn every pixel touched by the polygon
+    :return: boolean numpy array, True for pixels outside the polygon
+    """
+    mask_ds = gdal.GetDriverByName('MEM').Create(
+        '', xsize, ysize, 1, gdal.GDT_Byte)
+    mask_ds.SetGeoTransform(geo_trans)
+
+    mem_ds = ogr.GetDriverByName('Memory').CreateDataSource('mask')
+    mem_layer = mem_ds.CreateLayer('mask', None, poly.GetGeometryType())
+    feature = ogr.Feature(mem_layer.GetLayerDefn())
+    feature.SetGeometry(poly)
+    mem_layer.CreateFeature(feature)
+
+    options = ['ALL_TOUCHED=TRUE'] if all_touched else []
+    gdal.RasterizeLayer(mask_ds, [1], mem_layer, burn_values=[1],
+                        options=options)
+    return mask_ds.GetRasterBand(1).ReadAsArray() == 0
+
+
 def gdal_calc(calculation, raster_output, rasters,
               bands=None, nodata=None, allBands=False, output_type=None,
-              format='GTiff'):
+              format='GTiff', threads=None):
     """
     Adopted from GDAL 1.10 gdal_calc.py script.
 
@@ -350,11 +494,17 @@ def gdal_calc(calculation, raster_output, rasters,
     :param nodata: NoDataValue to use in output raster
     :param allBands: use all bands of specified raster by index
     :param output_type: data type for output raster ('Float32', 'Uint16', etc)
+    :param threads: number of threads computing blocks in parallel
+    (default is the calc_threads setting of the [gaia] configuration
+    section, or 1)
     :return: gdal Dataset
     """
 
     calculation = re.sub(r'(logical_|bitwise_)', r'numpy.\1', calculation)
 
+    # parse the calculation once, rather than once per block
+    evaluate = _compile_calculation(calculation)
+
     # set up some lists to store data for each band
     datasets = [get_dataset(raster) for raster in rasters]
     if not bands:
@@ -430,90 +580,89 @@ def gdal_calc(calculation, raster_output, rasters,
 
     # use the block size of the first layer to read efficiently
     block_size = datasets[0].GetRasterBand(bands[0]).GetBlockSize()
-    # store these numbers in variables that may change later
-    n_x_valid = block_size[0]
-    n_y_valid = block_size[1]
-    # find total x and y blocks to be read
-    n_x_blocks = int((dimensions[0] + block_size[0] - 1) / block_size[0])
-    n_y_blocks = int((dimensions[1] + block_size[1] - 1) / block_size[1])
-    buffer_size = block_size[0]*block_size[1]
 
-    ################################################################
-    # start looping through each band in allbandscount
-    ################################################################
-    for band_num in range(1, allbandscount+1):
-
-        ################################################################
-        # start looping through blocks of data
-        ################################################################
-        # loop through X-lines
-        for x in range(0, n_x_blocks):
-            # in the rare (impossible?) case that the blocks don't fit perfectly
-            # change the block size of the final piece
-            if x == n_x_blocks-1:
-                n_x_valid = dimensions[0] - x * block_size[0]
-                buffer_size = n_x_valid*n_y_valid
-
-            # find X offset
-            x_offset = x*block_size[0]
-
-            # reset buffer size for start of Y loop
-            n_y_valid = block_size[1]
-            buffer_size = n_x_valid*n_y_valid
-
-            # loop through Y lines
-            for y in range(0, n_y_blocks):
-                # change the block size of the final piece
-                if y == n_y_blocks-1:
-                    n_y_valid = dimensions[1] - y * block_size[1]
-                    buffer_size = n_x_valid*n_y_valid
-
-                # find Y offset
-                y_offset = y*block_size[1]
-
-                # create empty buffer to mark where nodata occurs
-                nodatavalues = numpy.zeros(buffer_size)
-                nodatavalues.shape = (n_y_valid, n_x_valid)
-
-                # fetch data for each input layer
-                for i, alpha in enumerate(alpha_list):
-
-                    # populate lettered arrays with values
-                    if allbandsindex is not None and allbandsindex == i:
-                        this_band = band_num
-                    else:
-                        this_band = bands[i]
-                    band_vals = BandReadAsArray(
-                        datasets[i].GetRasterBand(this_band),
-                        xoff=x_offset,
-                        yoff=y_offset,
-                        win_xsize=n_x_valid,
-                        win_ysize=n_y_valid)
-
-                    # fill in nodata values
-                    nodatavalues = 1*numpy.logical_or(
-                        nodatavalues == 1, band_vals == nodata_vals[i])
-
-                    # create an array of values for this block
-                    exec("%s=band_vals" % alpha)
-                    band_vals = None
-
-                # try the calculation on the array blocks
-                try:
-                    calc_result = eval(calculation)
-                except Exception as e:
-                    logger.error("eval of calculation %s failed" % calculation)
-                    raise e
+    # every block of every output band can be computed independently
+    windows = ((band_num, x_offset, n_x_valid, y_offset, n_y_valid)
+               for band_num in range(1, allbandscount+1)
+               for y_offset, n_y_valid in _block_ranges(
+                   0, dimensions[1], block_size[1])
+               for x_offset, n_x_valid in _block_ranges(
+                   0, dimensions[0], block_size[0]))
+
+    threads = _calc_threads(threads)
+    reader = _BlockReader(datasets, reopen=threads > 1)
+    write_lock = threading.Lock()
+
+    output_dtype = GDALTypeCodeToNumericTypeCode(
+        gdal.GetDataTypeByName(output_type))
+    buffers = _BlockBuffers()
+
+    def calc_block(window):
+        band_num, x_offset, n_x_valid, y_offset, n_y_valid = window
+        shape = (n_y_valid, n_x_valid)
+
+        # reuse this thread's buffer marking where nodata occurs
+        nodatavalues = buffers.get('nodata', shape, bool)
+        nodatavalues.fill(False)
+        scratch = buffers.get('scratch', shape, bool)
+
+        # fetch data for each input layer
+        block_vars = {}
+        for i, alpha in enumerate(alpha_list):
 
-                # propogate nodata values
-                # (set nodata cells to 0 then add nodata value to these cells)
-                calc_result = ((1 * (nodatavalues == 0)) * calc_result) + \
-                              (nodata * nodatavalues)
+            # populate lettered arrays with values
+            if allbandsindex is not None and allbandsindex == i:
+                this_band = band_num
+            else:
+                this_band = bands[i]
+            band_vals = reader.read(i, this_band, x_offset, y_offset,
+                                    n_x_valid, n_y_valid)
+
+            # fill in nodata values
+            _mark_nodata(band_vals, nodata_vals[i], nodatavalues, scratch)
 
-                # write data block to the output file
-                output_band = output_dataset.GetRasterBand(band_num)
-                BandWriteArray(output_band, calc_result,
-                               xoff=x_offset, yoff=y_offset)
+            # create an array of values for this block
+            block_vars[alpha] = band_vals
+
+        # try the calculation on the array blocks
+        try:
+            calc_result = numpy.asarray(evaluate(block_vars))
+        except Exception as e:
+            logger.error("eval of calculation %s failed" % calculation)
+            raise e
+
+        # propogate nodata values, in a buffer whose type holds both the
+        # result and the nodata value; GDAL converts it to the band type
+        dtype = numpy.result_type(calc_result.dtype, output_dtype)
+        block_result = buffers.get('result', shape, dtype)
+        numpy.copyto(block_result, calc_result)
+        numpy.copyto(block_result, nodata, casting='unsafe',
+                     where=nodatavalues)
+
+        # write data block to the output file
+        with write_lock:
+            output_band = output_dataset.GetRasterBand(band_num)
+            BandWriteArray(output_band, block_result,
+                           xoff=x_offset, yoff=y_offset)
+
+    ################################################################
+    # process the blocks, spread over a pool of threads
+    ################################################################
+    # GDAL releases the GIL while reading and numpy while computing.
+    # Workers write their own blocks, so at most one block per thread
+    # is held in memory, and blocks never overlap, so the output does
+    # not depend on the order in which they complete.
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            for _ in pool.imap_unordered(calc_block, windows):
+                pass
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for window in windows:
+            calc_block(window)
 
     if raster_output:
         output_driver = gdal.GetDriverByName(format)
@@ -522,15 +671,292 @@ def gdal_calc(calculation, raster_output, rasters,
     return output_dataset
 
 
-def gdal_zonalstats(zones, raster):
+#: numpy ufuncs computing the operators allowed in gdal_calc expressions
+calc_binary_ops = {
+    ast.Add: numpy.add,
+    ast.Sub: numpy.subtract,
+    ast.Mult: numpy.multiply,
+    ast.Div: numpy.divide,
+    ast.FloorDiv: numpy.floor_divide,
+    ast.Mod: numpy.remainder,
+    ast.Pow: numpy.power,
+    ast.BitAnd: numpy.bitwise_and,
+    ast.BitOr: numpy.bitwise_or,
+    ast.BitXor: numpy.bitwise_xor
+}
+calc_compare_ops = {
+    ast.Eq: numpy.equal,
+    ast.NotEq: numpy.not_equal,
+    ast.Lt: numpy.less,
+    ast.LtE: numpy.less_equal,
+    ast.Gt: numpy.greater,
+    ast.GtE: numpy.greater_equal
+}
+calc_unary_ops = {
+    ast.USub: numpy.negative,
+    ast.Invert: numpy.invert
+}
+
+
+def _calc_threads(threads=None):
+    """
+    Return the number of threads of a raster calculation, by default the
+    calc_threads setting of the [gaia] configuration section, or 1 so that
+    callers already running in worker pools stay single-threaded.
+
+    :param threads: requested number of threads, or None
+    :return: number of threads
+    """
+    if threads is None:
+        import gaia
+        settings = gaia.get_config().get('gaia', {})
+        threads = int(settings.get('calc_threads') or 1)
+    return max(1, threads)
+
+
+def _compile_calculation(calculation):
+    """
+    Compile a gdal_calc expression into a function of the block arrays.
+
+    The expression is parsed once.  Its operators become direct numpy
+    ufunc calls, and when an operand is a temporary array produced by an
+    inner operator, the result is written into it (out=) instead of
+    being allocated afresh.  Other constructs are compiled with compile()
+    and evaluated as they are.
+
+    :param calculation: expression such as (A - B) / (A + B)
+    :return: function of a dict of block arrays keyed by letter
+    """
+    tree = ast.parse(calculation.strip(), mode='eval')
+    compiled = _compile_calc_node(tree.body)
+
+    def evaluate(block_vars):
+        return compiled(block_vars)[0]
+    return evaluate
+
+
+def _compile_calc_node(node):
+    """
+    Compile an expression node into a function of the block arrays,
+    returning the node value and whether that value is a temporary.
+    """
+    if isinstance(node, ast.Name) and node.id in string.ascii_uppercase:
+        name = node.id
+        return lambda block_vars: (block_vars[name], False)
+
+    try:
+        value = ast.literal_eval(node)
+        return lambda block_vars: (value, False)
+    except (ValueError, TypeError, SyntaxError):
+        pass
+
+    if isinstance(node, ast.BinOp) and type(node.op) in calc_binary_ops:
+        ufunc = calc_binary_ops[type(node.op)]
+        operands = [_compile_calc_node(node.left),
+                    _compile_calc_node(node.right)]
+        return lambda block_vars: _calc_ufunc(ufunc, operands, block_vars)
+
+    if (isinstance(node, ast.Compare) and len(node.ops) == 1 and
+            type(node.ops[0]) in calc_compare_ops):
+        ufunc = calc_compare_ops[type(node.ops[0])]
+        operands = [_compile_calc_node(node.left),
+                    _compile_calc_node(node.comparators[0])]
+        return lambda block_vars: _calc_ufunc(ufunc, operands, block_vars)
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in calc_unary_ops:
+        ufunc = calc_unary_ops[type(node.op)]
+        operands = [_compile_calc_node(node.operand)]
+        return lambda block_vars: _calc_ufunc(ufunc, operands, block_vars)
+
+    if (isinstance(node, ast.Call) and not node.keywords and
+            not any(isinstance(arg, getattr(ast, 'Starred', ()))
+                    for arg in node.args) and
+            not getattr(node, 'starargs', None) and
+            not getattr(node, 'kwargs', None)):
+        function = _compile_calc_node(node.func)
+        arguments = [_compile_calc_node(arg) for arg in node.args]
+
+        def call(block_vars):
+            values = [arg(block_vars)[0] for arg in arguments]
+            # the result may be a view of an argument, never reuse it
+            return function(block_vars)[0](*values), False
+        return call
+
+    code = compile(ast.Expression(body=node), '<calculation>', 'eval')
+    return lambda block_vars: (eval(code, globals(), block_vars), False)
+
+
+def _calc_ufunc(ufunc, operands, block_vars):
+    """
+    Apply a ufunc to compiled operands, writing the result into one of
+    them when it is a temporary of the right shape and type.
+    """
+    values = []
+    temporaries = []
+    for operand in operands:
+        value, temporary = operand(block_vars)
+        values.append(value)
+        if temporary:
+            temporaries.append(value)
+
+    if temporaries:
+        shape = numpy.broadcast(*values).shape
+        # The dtype the ufunc returns for these operands (a comparison
+        # returns booleans), from a call on empty arrays of their dtypes
+        dtype = ufunc(*[value.reshape(-1)[:0]
+                        if isinstance(value, numpy.ndarray) else value
+                        for value in values]).dtype
+        for out in temporaries:
+            if out.shape == shape and out.dtype == dtype:
+                try:
+                    return ufunc(*values, out=out), True
+                except TypeError:
+                    # e.g. the true division of integers is a float
+                    break
+
+    result = ufunc(*values)
+    return result, isinstance(result, numpy.ndarray)
+
+
+class _BlockReader(object):
+    """
+    Reads windows of a list of GDAL datasets from several threads.
+
+    GDAL dataset handles must not be used by two threads at once, so
+    datasets backed by a file are reopened once per thread, while
+    in-memory and virtual datasets are read under a lock.
+    """
+    def __init__(self, datasets, reopen=True):
+        self._datasets = datasets
+        self._paths = [_dataset_path(ds) if reopen else None
+                       for ds in datasets]
+        self._locks = [threading.Lock() for ds in datasets]
+        self._local = threading.local()
+
+    def read(self, index, band, xoff, yoff, xsize, ysize):
+        path = self._paths[index]
+        if path is None:
+            with self._locks[index]:
+                return BandReadAsArray(
+                    self._datasets[index].GetRasterBand(band),
+                    xoff=xoff, yoff=yoff, win_xsize=xsize, win_ysize=ysize)
+
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = {}
+        if index not in handles:
+            handles[index] = gdal.Open(path, gdalconst.GA_ReadOnly)
+        return BandReadAsArray(
+            handles[index].GetRasterBand(band),
+            xoff=xoff, yoff=yoff, win_xsize=xsize, win_ysize=ysize)
+
+
+class _BlockBuffers(object):
+    """
+    Scratch arrays reused from block to block, one set per thread.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, name, shape, dtype):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        key = (name, shape, numpy.dtype(dtype))
+        if key not in buffers:
+            buffers[key] = numpy.empty(shape, dtype=dtype)
+        return buffers[key]
+
+
+def _mark_nodata(values, nodata_value, mask, scratch):
+    """
+    Add the pixels of values equal to nodata_value to a boolean mask,
+    in place, using scratch as the comparison buffer.
+    """
+    if nodata_value is None:
+        return
+    if nodata_value != nodata_value:
+        numpy.isnan(values, out=scratch)
+    else:
+        numpy.equal(values, nodata_value, out=scratch)
+    numpy.logical_or(mask, scratch, out=mask)
+
+
+def _dataset_path(dataset):
+    """
+    Return the path of the file a GDAL dataset was opened from, or None
+    for in-memory and virtual datasets
+    """
+    driver = dataset.GetDriver().ShortName
+    path = dataset.GetDescription()
+    if driver in ('MEM', 'VRT') or not path or not os.path.isfile(path):
+        return None
+    return path
+
+
+def gdal_iter_tiles(raster, tile_size=None, bbox=None):
+    """
+    Generator function that reads a raster dataset in tiles made of
+    whole blocks of its first band, so each block is read once.
+
+    :param raster: Raster dataset or file path
+    :param tile_size: approximate size in pixels of the tiles' edges
+    (default is the size of a block)
+    :param bbox: (minx, miny, maxx, maxy) in the raster's coordinates,
+    to only read the tiles covering it
+    :return: generator of ((xoff, yoff, xsize, ysize), array) pairs, with
+    2D arrays for single band rasters and 3D (band, row, column) ones
+    otherwise
+    """
+    raster = get_dataset(raster)
+    block_xsize, block_ysize = raster.GetRasterBand(1).GetBlockSize()
+    if tile_size:
+        tile_xsize = max(1, tile_size // block_xsize) * block_xsize
+        tile_ysize = max(1, tile_size // block_ysize) * block_ysize
+    else:
+        tile_xsize, tile_ysize = block_xsize, block_ysize
+
+    if bbox is None:
+        xoff, yoff, xsize, ysize = 0, 0, raster.RasterXSize, raster.RasterYSize
+    else:
+        minx, miny, maxx, maxy = bbox
+        xoff, yoff, xsize, ysize = _envelope_window(
+            raster.GetGeoTransform(), (minx, maxx, miny, maxy),
+            raster.RasterXSize, raster.RasterYSize)
+
+    for tile_yoff, tile_ysize_valid in _block_ranges(yoff, ysize, tile_ysize):
+        for tile_xoff, tile_xsize_valid in _block_ranges(
+                xoff, xsize, tile_xsize):
+            window = (tile_xoff, tile_yoff, tile_xsize_valid, tile_ysize_valid)
+            yield window, raster.ReadAsArray(*window)
+
+
+def gdal_zonalstats(zones, raster, engine='batched', processes=None,
+                    stats=None):
     """
     Return a list of zonal statistics.
 
     :param zones: vector dataset in JSON format representing polygons (zones)
     :param raster: Raster file to generate statistics from in each polygon
+    :param engine: 'batched' (default) rasterizes all the zones together
+    and reduces them in one pass over the raster (see
+    gen_zonalstats_batched), 'feature' processes one zone at a time
+    :param processes: number of worker processes to spread the zones over
+    (see gen_zonalstats_parallel), None or 1 to compute them in this process
+    :param stats: names of the statistics to compute, by default those of
+    zonal_stats; percentiles are requested as 'percentile_<q>'
     :return: list of polygon features with statistics properties appended.
     """
-    return list(gen_zonalstats(zones, raster))
+    if engine not in ('feature', 'batched'):
+        raise GaiaException(
+            'Unknown zonal statistics engine {}'.format(engine))
+    stats = _check_zonal_stats(stats)
+    if processes is not None and processes > 1:
+        return list(gen_zonalstats_parallel(
+            zones, raster, processes, engine=engine, stats=stats))
+    if engine == 'feature':
+        return list(gen_zonalstats(zones, raster, stats))
+    return list(gen_zonalstats_batched(zones, raster, stats))
 
 
 def rasterio_bbox(raster_input):
@@ -566,15 +992,18 @@ def rasterio_footprint(raster_input):
         return list(shape.minimum_rotated_rectangle.exterior.coords)
 
 
-def gen_zonalstats(zones_json, raster):
+def gen_zonalstats(zones_json, raster, stats=None):
     """
     Generator function that yields the statistics of a raster dataset
     within each polygon (zone) of a vector dataset.
 
     :param zones_json: Polygons in GeoJSON format
     :param raster: Raster dataset
+    :param stats: Names of the statistics to compute (see zonal_stats),
+    all the default ones if None
     :return: Polygons with additional properties for calculated raster stats.
     """
+    stats = _check_zonal_stats(stats)
     global_transform = True
 
     # Open data
@@ -694,48 +1123,536 @@ def gen_zonalstats(zones_json, raster):
         banddataraster = raster.GetRasterBand(1)
         try:
             dataraster = banddataraster.ReadAsArray(
-                xoff, yoff, xcount, ycount).astype(numpy.float)
-        except AttributeError:
+                xoff, yoff, xcount, ycount)
+        except (RuntimeError, ValueError):
+            dataraster = None
+        if dataraster is None:
             # Nothing within bounds, move on to next polygon
-            properties = feature['properties']
-            for p in ['count', 'sum', 'mean', 'median', 'min', 'max', 'stddev']:
-                properties[p] = None
-            yield(feature)
-        else:
-            # Get no data value of array
-            noDataValue = banddataraster.GetNoDataValue()
-            if noDataValue:
-                # Updata no data value in array with new value
-                dataraster[dataraster == noDataValue] = numpy.nan
-
-            bandmask = target_ds.GetRasterBand(1)
-            datamask = bandmask.ReadAsArray(
-                0, 0, xcount, ycount).astype(numpy.float)
-
-            # Mask zone of raster
-            zoneraster = numpy.ma.masked_array(
-                dataraster,  numpy.logical_not(datamask))
-
-            properties = feature['properties']
-            properties['count'] = zoneraster.count()
-            properties['sum'] = numpy.nansum(zoneraster)
-            if type(properties['sum']) == MaskedConstant:
-                # No non-null values for raster data in polygon, skip
-                for p in ['sum', 'mean', 'median', 'min', 'max', 'stddev']:
-                    properties[p] = None
-            else:
-                properties['mean'] = numpy.nanmean(zoneraster)
-                properties['min'] = numpy.nanmin(zoneraster)
-                properties['max'] = numpy.nanmax(zoneraster)
-                properties['stddev'] = numpy.nanstd(zoneraster)
-                median = numpy.ma.median(zoneraster)
-                if hasattr(median, 'data'):
-                    try:
-                        properties['median'] = median.data.item()
-                    except AttributeError:
-                        if median:
-                            properties['median'] = median
+            feature['properties'].update(dict.fromkeys(stats))
             yield(feature)
+            continue
+
+        # Keep the pixels of the zone that are not nodata
+        datamask = target_ds.GetRasterBand(1).ReadAsArray(
+            0, 0, xcount, ycount) > 0
+        noDataValue = banddataraster.GetNoDataValue()
+        if noDataValue is not None:
+            datamask &= dataraster != noDataValue
+        if dataraster.dtype.kind == 'f':
+            datamask &= ~numpy.isnan(dataraster)
+
+        feature['properties'].update(
+            _zonal_stats(dataraster[datamask], stats))
+        yield(feature)
+
+
+def gen_zonalstats_batched(zones_json, raster, stats=None, tile_size=1024):
+    """
+    Generator function that yields the statistics of a raster dataset
+    within each polygon (zone) of a vector dataset, like gen_zonalstats.
+
+    Instead of creating a raster and a layer for every zone, all the
+    zones are rasterized together into a label raster aligned with the
+    value raster, one tile at a time, and the statistics of every zone
+    are accumulated from each tile with numpy.bincount style reductions.
+    A label raster holds one zone per pixel, so the zones overlapping
+    other ones are computed one by one by gen_zonalstats instead.
+
+    :param zones_json: Polygons in GeoJSON format
+    :param raster: Raster dataset
+    :param stats: Names of the statistics to compute (see zonal_stats),
+    all the default ones if None
+    :param tile_size: approximate size in pixels of the tiles read
+    :return: Polygons with additional properties for calculated raster stats.
+    """
+    stats = _check_zonal_stats(stats)
+    # Values only need to be kept for the order statistics other than
+    # min and max, which are reduced tile by tile like the moments
+    kept_stats = [p for p in stats if p not in ('count', 'sum', 'mean',
+                                                'min', 'max', 'stddev')]
+
+    # Open data
+    raster = get_dataset(raster)
+    if type(zones_json) is str:
+        zones_json = json.loads(zones_json)
+    features = zones_json['features']
+
+    overlapping = _overlapping_zones(features)
+    zone_features = {}
+    if overlapping:
+        logger.info('{} overlapping zones, computing them one by one'.format(
+            len(overlapping)))
+        overlapping_zones = dict(zones_json, features=[
+            features[index] for index in overlapping])
+        zone_features = dict(zip(overlapping, gen_zonalstats(
+            overlapping_zones, raster, stats)))
+
+    mem_ds, zone_layer = _zone_label_layer(zones_json, raster, overlapping)
+    zones = _ZoneAccumulator(len(features) + 1, bool(kept_stats))
+
+    # Only the part of the raster under the zones needs to be read,
+    # in tiles made of whole raster blocks
+    transform = raster.GetGeoTransform()
+    band = raster.GetRasterBand(1)
+    noDataValue = band.GetNoDataValue()
+    block_xsize, block_ysize = band.GetBlockSize()
+    tile_xsize = max(1, tile_size // block_xsize) * block_xsize
+    tile_ysize = max(1, tile_size // block_ysize) * block_ysize
+    xoff, yoff, xsize, ysize = 0, 0, 0, 0
+    if zone_layer.GetFeatureCount():
+        xoff, yoff, xsize, ysize = _envelope_window(
+            transform, zone_layer.GetExtent(),
+            raster.RasterXSize, raster.RasterYSize)
+
+    for tile_yoff, tile_ysize_valid in _block_ranges(yoff, ysize, tile_ysize):
+        for tile_xoff, tile_xsize_valid in _block_ranges(
+                xoff, xsize, tile_xsize):
+            window = (tile_xoff, tile_yoff, tile_xsize_valid, tile_ysize_valid)
+            labels = _rasterize_zone_labels(zone_layer, raster, window)
+            in_zone = labels > 0
+            if not in_zone.any():
+                continue
+            zones.cover(labels[in_zone])
+
+            # Read raster as arrays and drop the nodata pixels
+            dataraster = band.ReadAsArray(*window)
+            valid = in_zone
+            if noDataValue is not None:
+                valid &= dataraster != noDataValue
+            if dataraster.dtype.kind == 'f':
+                valid &= ~numpy.isnan(dataraster)
+            zones.add(labels[valid], dataraster[valid])
+
+    for index, feature in enumerate(features):
+        if index in zone_features:
+            yield zone_features.pop(index)
+            continue
+        properties = feature.get('properties') or {}
+        feature['properties'] = properties
+        properties.update(zones.zone_stats(index + 1, stats, kept_stats))
+        yield feature
+
+
+def _overlapping_zones(features):
+    """
+    Return the indices of the GeoJSON polygons whose interior intersects
+    the interior of another one.
+
+    :param features: Polygon features in GeoJSON format
+    :return: sorted list of feature indices
+    """
+    if len(features) < 2:
+        return []
+    geometries = geopandas.GeoSeries(
+        [shapely.geometry.shape(feature['geometry'])
+         for feature in features])
+    overlapping = set()
+    for predicate in ('overlaps', 'contains'):
+        left, right = geometries.sindex.query(geometries, predicate=predicate)
+        pairs = left != right
+        overlapping.update(left[pairs].tolist())
+        overlapping.update(right[pairs].tolist())
+    return sorted(overlapping)
+
+
+def _zone_label_layer(zones_json, raster, skipped):
+    """
+    Copy GeoJSON polygons, reprojected to the projection of a raster, to a
+    memory layer whose 'zone' attribute numbers them from 1 in input order
+    (0 being the background of label rasters).
+
+    :param zones_json: Polygons in GeoJSON format
+    :param raster: Raster dataset
+    :param skipped: indices of the polygons not to copy
+    :return: the memory data source and its layer
+    """
+    shp = ogr.Open(json.dumps(zones_json))
+    lyr = shp.GetLayer()
+
+    targetSR = osr.SpatialReference()
+    targetSR.ImportFromWkt(raster.GetProjectionRef())
+    if hasattr(targetSR, 'SetAxisMappingStrategy'):
+        targetSR.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    sourceSR = lyr.GetSpatialRef()
+    coordTrans = None
+    if (sourceSR is not None and
+            sourceSR.ExportToWkt() != targetSR.ExportToWkt()):
+        coordTrans = osr.CoordinateTransformation(sourceSR, targetSR)
+
+    mem_ds = ogr.GetDriverByName('Memory').CreateDataSource('zones')
+    zone_layer = mem_ds.CreateLayer('zones', targetSR, ogr.wkbUnknown)
+    zone_layer.CreateField(ogr.FieldDefn('zone', ogr.OFTInteger))
+    skipped = set(skipped)
+    for index, feat in enumerate(lyr):
+        geom = feat.geometry()
+        if geom.GetGeometryName() not in ('POLYGON', 'MULTIPOLYGON'):
+            raise GaiaException(
+                "ERROR: Geometry needs to be either Polygon or Multipolygon")
+        if index in skipped:
+            continue
+        if coordTrans is not None:
+            geom.Transform(coordTrans)
+        zone = ogr.Feature(zone_layer.GetLayerDefn())
+        zone.SetField('zone', index + 1)
+        zone.SetGeometry(geom)
+        zone_layer.CreateFeature(zone)
+    return mem_ds, zone_layer
+
+
+def _rasterize_zone_labels(zone_layer, raster, window):
+    """
+    Rasterize the zones of a label layer over a window of a raster.
+
+    :param zone_layer: layer made by _zone_label_layer
+    :param raster: Raster dataset
+    :param window: (xoff, yoff, xsize, ysize) window in pixels
+    :return: 2-D array of the zone labels, 0 outside of the zones
+    """
+    xoff, yoff, xsize, ysize = window
+    transform = raster.GetGeoTransform()
+    tile_transform = list(transform)
+    tile_transform[0] = transform[0] + xoff * transform[1]
+    tile_transform[3] = transform[3] + yoff * transform[5]
+
+    label_ds = gdal.GetDriverByName('MEM').Create(
+        '', xsize, ysize, 1, gdal.GDT_Int32)
+    label_ds.SetGeoTransform(tile_transform)
+    label_ds.SetProjection(raster.GetProjectionRef())
+    xs = sorted([tile_transform[0], tile_transform[0] + xsize * transform[1]])
+    ys = sorted([tile_transform[3], tile_transform[3] + ysize * transform[5]])
+    zone_layer.SetSpatialFilterRect(xs[0], ys[0], xs[1], ys[1])
+    gdal.RasterizeLayer(label_ds, [1], zone_layer,
+                        options=['ATTRIBUTE=zone'])
+    zone_layer.SetSpatialFilter(None)
+    return label_ds.GetRasterBand(1).ReadAsArray()
+
+
+class _ZoneAccumulator(object):
+    """
+    Running statistics of the pixel values of labeled zones, merged tile
+    by tile (Chan et al. for the mean and variance).
+
+    :param size: number of labels, label 0 included
+    :param keep_values: keep the values of each zone, for the order
+    statistics other than min and max
+    """
+    def __init__(self, size, keep_values=False):
+        self.size = size
+        self.covered = numpy.zeros(size, dtype=numpy.int64)
+        self.count = numpy.zeros(size)
+        self.total = numpy.zeros(size)
+        self.mean = numpy.zeros(size)
+        self.m2 = numpy.zeros(size)
+        self.mins = numpy.full(size, numpy.inf)
+        self.maxs = numpy.full(size, -numpy.inf)
+        self.values = [[] for i in range(size)] if keep_values else None
+
+    def cover(self, labels):
+        """
+        Count the pixels of the zones, nodata pixels included.
+
+        :param labels: 1-D array of the labels of the pixels
+        """
+        self.covered += numpy.bincount(labels, minlength=self.size)
+
+    def add(self, labels, values):
+        """
+        Merge the valid pixel values of a tile into the statistics.
+
+        :param labels: 1-D array of the labels of the pixels
+        :param values: 1-D array of the values of the pixels
+        """
+        if not len(labels):
+            return
+        size = self.size
+        values = values.astype(numpy.float64)
+        tile_count = numpy.bincount(labels, minlength=size)
+        tile_total = numpy.bincount(labels, weights=values, minlength=size)
+        present = tile_count > 0
+        tile_mean = numpy.zeros(size)
+        tile_mean[present] = tile_total[present] / tile_count[present]
+        tile_m2 = numpy.bincount(
+            labels, weights=(values - tile_mean[labels])**2, minlength=size)
+        merged = self.count + tile_count
+        delta = tile_mean - self.mean
+        self.mean[present] += (delta * tile_count)[present] / merged[present]
+        self.m2[present] += tile_m2[present] + (
+            delta**2 * self.count * tile_count)[present] / merged[present]
+        self.count = merged
+        self.total += tile_total
+
+        # Group the values by zone for the order statistics
+        order = numpy.argsort(labels, kind='mergesort')
+        sorted_labels = labels[order]
+        sorted_values = values[order]
+        starts = numpy.flatnonzero(numpy.concatenate(
+            ([True], sorted_labels[1:] != sorted_labels[:-1])))
+        zone_labels = sorted_labels[starts]
+        self.mins[zone_labels] = numpy.minimum(
+            self.mins[zone_labels],
+            numpy.minimum.reduceat(sorted_values, starts))
+        self.maxs[zone_labels] = numpy.maximum(
+            self.maxs[zone_labels],
+            numpy.maximum.reduceat(sorted_values, starts))
+        if self.values is not None:
+            for label, zone_values in zip(
+                    zone_labels, numpy.split(sorted_values, starts[1:])):
+                self.values[label].append(zone_values)
+
+    def zone_stats(self, label, stats, kept_stats=()):
+        """
+        Return the statistics of a zone, and release its kept values.
+
+        :param label: label of the zone
+        :param stats: list of statistic names (see zonal_stats)
+        :param kept_stats: the statistics computed from the kept values
+        :return: dict of statistic values
+        """
+        if not self.covered[label]:
+            # Nothing within bounds
+            return dict.fromkeys(stats)
+        if not self.count[label]:
+            # No non-null values for raster data in polygon
+            return _zonal_stats(numpy.empty(0), stats)
+        count = self.count[label]
+        zone_stats = {
+            'count': int(count),
+            'sum': float(self.total[label]),
+            'mean': float(self.mean[label]),
+            'min': float(self.mins[label]),
+            'max': float(self.maxs[label]),
+            'stddev': float(numpy.sqrt(self.m2[label] / count)),
+        }
+        if kept_stats:
+            zone_stats.update(_zonal_stats(
+                numpy.concatenate(self.values[label]), kept_stats))
+            self.values[label] = None
+        return dict((p, zone_stats[p]) for p in stats)
+
+
+def gen_zonalstats_parallel(zones_json, raster, processes, engine='batched',
+                            stats=None, batch_size=None):
+    """
+    Generator function that yields the statistics of a raster dataset
+    within each polygon (zone) of a vector dataset, computed by a pool
+    of worker processes.
+
+    The zones are sorted along a Z-order (Morton) curve so that each batch
+    sent to a worker covers a compact part of the raster, and every worker
+    opens the raster itself (GDAL datasets cannot be pickled), from its
+    path or its VRT description. Features are yielded in input order as
+    soon as the batches holding them are done. In-memory rasters cannot
+    be reopened by the workers and are processed in this process instead.
+
+    :param zones_json: Polygons in GeoJSON format
+    :param raster: Raster dataset
+    :param processes: Number of worker processes
+    :param engine: Zonal statistics engine used by the workers,
+    'batched' or 'feature'
+    :param stats: Names of the statistics to compute (see zonal_stats),
+    all the default ones if None
+    :param batch_size: Number of zones per batch, by default the zones
+    are split in 4 batches per process
+    :return: Polygons with additional properties for calculated raster stats.
+    """
+    dataset = get_dataset(raster)
+    if type(zones_json) is str:
+        zones_json = json.loads(zones_json)
+    features = zones_json['features']
+
+    source = _dataset_source(dataset)
+    if source is None:
+        logger.warning('Raster {} cannot be opened by worker processes, '
+                       'computing zonal statistics serially'.format(
+                           dataset.GetDescription()))
+        generator = (gen_zonalstats if engine == 'feature'
+                     else gen_zonalstats_batched)
+        for feature in generator(zones_json, dataset, stats):
+            yield feature
+        return
+
+    if not batch_size:
+        batch_size = max(1, int(math.ceil(
+            len(features) / float(processes * 4))))
+    order = _morton_order(zones_json)
+    collection = {k: v for k, v in zones_json.items() if k != 'features'}
+    tasks = []
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        batch = dict(collection, features=[features[i] for i in indices])
+        tasks.append((source, engine, stats, indices, batch))
+
+    pool = multiprocessing.Pool(min(processes, len(tasks)) or 1)
+    try:
+        # Buffer out of order results until the next feature is available
+        done = {}
+        next_index = 0
+        for indices, results in pool.imap_unordered(
+                _zonalstats_worker, tasks):
+            done.update(zip(indices, results))
+            while next_index in done:
+                features[next_index] = done.pop(next_index)
+                yield features[next_index]
+                next_index += 1
+    finally:
+        pool.terminate()
+
+
+def _zonalstats_worker(task):
+    """
+    Compute the zonal statistics of a batch of zones in a worker process.
+
+    :param task: tuple of the raster path or VRT description, the engine
+    name, the statistics, the indices of the zones and the zones in GeoJSON
+    format
+    :return: the indices and the zones with their statistics
+    """
+    source, engine, stats, indices, zones_json = task
+    raster = gdal.Open(source, gdalconst.GA_ReadOnly)
+    generator = (gen_zonalstats if engine == 'feature'
+                 else gen_zonalstats_batched)
+    return indices, list(generator(zones_json, raster, stats))
+
+
+def _dataset_source(dataset):
+    """
+    Return a string another process can open a GDAL dataset from: the
+    path of its file or, for virtual datasets, their VRT description.
+    None for in-memory datasets.
+    """
+    path = dataset.GetDescription()
+    if path and os.path.isfile(path):
+        return path
+    if dataset.GetDriver().ShortName == 'VRT':
+        vrt = dataset.GetMetadata('xml:VRT')
+        if vrt:
+            return vrt[0]
+    return None
+
+
+def _morton_order(zones_json):
+    """
+    Return the indices of GeoJSON features sorted along a Z-order curve
+    through the centers of their envelopes.
+
+    :param zones_json: Features in GeoJSON format
+    :return: list of feature indices
+    """
+    centers = []
+    for feature in zones_json['features']:
+        geom = ogr.CreateGeometryFromJson(json.dumps(feature['geometry']))
+        minx, maxx, miny, maxy = geom.GetEnvelope()
+        centers.append(((minx + maxx) / 2.0, (miny + maxy) / 2.0))
+    if not centers:
+        return []
+    centers = numpy.array(centers)
+    low = centers.min(axis=0)
+    span = centers.max(axis=0) - low
+    span[span == 0] = 1
+    cells = ((centers - low) / span * 0xffff).astype(numpy.int64)
+
+    def spread(v):
+        # Insert a 0 bit between each of the 16 low bits of v
+        v = (v | (v << 8)) & 0x00ff00ff
+        v = (v | (v << 4)) & 0x0f0f0f0f
+        v = (v | (v << 2)) & 0x33333333
+        return (v | (v << 1)) & 0x55555555
+
+    codes = spread(cells[:, 0]) | (spread(cells[:, 1]) << 1)
+    return numpy.argsort(codes, kind='mergesort').tolist()
+
+
+def _check_zonal_stats(stats):
+    """
+    Validate a selection of zonal statistics.
+
+    :param stats: list of statistic names, None for zonal_stats
+    :return: list of statistic names
+    """
+    if stats is None:
+        return list(zonal_stats)
+    for p in stats:
+        if p in zonal_stats:
+            continue
+        match = re.match(r'^percentile_(\d+(\.\d+)?)$', p)
+        if not match or float(match.group(1)) > 100:
+            raise GaiaException('Unknown zonal statistic {}'.format(p))
+    return list(stats)
+
+
+def _zonal_stats(values, stats):
+    """
+    Compute statistics of the valid pixel values of a zone.
+
+    The order statistics (min, max, median and percentiles) are all read
+    from a single numpy.partition of the values (see _order_stats).
+
+    :param values: 1-D array of the valid pixel values
+    :param stats: list of statistic names (see zonal_stats)
+    :return: dict of statistic values, None when there are no values
+    except for the count
+    """
+    count = len(values)
+    result = dict.fromkeys(stats)
+    if 'count' in result:
+        result['count'] = count
+    if not count:
+        return result
+
+    if 'sum' in result or 'mean' in result or 'stddev' in result:
+        total = values.sum(dtype=numpy.float64)
+        mean = total / count
+        if 'sum' in result:
+            result['sum'] = float(total)
+        if 'mean' in result:
+            result['mean'] = float(mean)
+        if 'stddev' in result:
+            deviations = values.astype(numpy.float64) - mean
+            result['stddev'] = float(numpy.sqrt(
+                numpy.dot(deviations, deviations) / count))
+
+    result.update(_order_stats(values, stats))
+    return result
+
+
+def _order_stats(values, stats):
+    """
+    Compute the order statistics (min, max, median and percentiles) of
+    values from a single numpy.partition, medians and percentiles being
+    interpolated linearly like numpy.median and numpy.percentile.
+
+    :param values: non-empty 1-D array of values
+    :param stats: list of statistic names, the other statistics than
+    order statistics being ignored
+    :return: dict of the order statistic values
+    """
+    # Fractional ranks of the requested order statistics
+    count = len(values)
+    ranks = {}
+    for p in stats:
+        if p == 'min':
+            ranks[p] = 0
+        elif p == 'max':
+            ranks[p] = count - 1
+        elif p == 'median':
+            ranks[p] = (count - 1) / 2.0
+        elif p.startswith('percentile_'):
+            ranks[p] = (count - 1) * float(p[len('percentile_'):]) / 100
+    if not ranks:
+        return {}
+
+    kth = set()
+    for rank in ranks.values():
+        kth.update((int(math.floor(rank)), int(math.ceil(rank))))
+    partitioned = numpy.partition(values, sorted(kth))
+    result = {}
+    for p, rank in ranks.items():
+        low = int(math.floor(rank))
+        value = float(partitioned[low])
+        if rank > low:
+            value += (rank - low) * (float(partitioned[low + 1]) - value)
+        result[p] = value
+    return result
 
 
 def get_dataset(object):
@@ -80,7 +80,14 @@ class GaiaReaderFactoryMetaclass(type):
 class GaiaReader(with_metaclass(GaiaReaderFactoryMetaclass, object)):
     """
     Abstract base class, root of the reader class hierarchy.
+
+    Readers whose sources always hold one kind of data declare its
+    datatype (a gaia.types value) and container (the type of the data
+    load_data sets), so that they are known without reading the source.
     """
+    datatype = None
+    container = None
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -95,3 +102,17 @@ class GaiaReader(with_metaclass(GaiaReaderFactoryMetaclass, object)):
 
     def load_data(self, dataObject):
         print('GaiaReader _load_data()')
+
+    def iter_chunks(self, dataObject, chunk_size=None, bbox=None):
+        """
+        Iterate over the data of a data object in chunks.  Readers that
+        can stream their source override this, by default the data is
+        loaded and then split.
+
+        :param dataObject: GaiaDataObject being read
+        :param chunk_size: size of the chunks (see GaiaDataObject.iter_chunks)
+        :param bbox: (minx, miny, maxx, maxy) to restrict the data to
+        :return: generator of data chunks
+        """
+        return dataObject._iter_data_chunks(
+            dataObject.get_data(), chunk_size, bbox)
@@ -33,12 +33,17 @@ class GaiaGDALReader(GaiaReader):
     """
     A specific subclass for reading GDAL files
     """
+    datatype = types.RASTER
+    container = gdal.Dataset
+
     def __init__(self, url, *args, **kwargs):
         super(GaiaGDALReader, self).__init__(*args, **kwargs)
 
         self.uri = url
         self.ext = '.%s' % get_uri_extension(self.uri)
 
+        self.format = None
+        self.epsg = None
         self.as_numpy_array = False
         self.as_single_band = True
         self.old_nodata = None
@@ -87,8 +92,20 @@ class GaiaGDALReader(GaiaReader):
         return o
 
     def load_metadata(self, dataObject):
-        # self.__read_internal(dataObject)
-        data = dataObject.get_data()
+        """
+        Describe the raster from its header, without reading any pixels.
+
+        If the data has not been loaded yet, the file is opened just to
+        parse its header, and when an EPSG code was requested the header
+        of a warped VRT is used instead: creating the VRT computes the
+        output grid but reads and resamples nothing.  The metadata is
+        cached on the data object.
+        """
+        data = dataObject._data
+        if data is None:
+            data = self.__open()
+            if self.epsg and _get_dataset_epsg(data) != self.epsg:
+                data = gdal_reproject(data, '', epsg=self.epsg)
 
         # Get corner points
         gt = data.GetGeoTransform()
@@ -118,20 +135,38 @@ class GaiaGDALReader(GaiaReader):
         coords = [[
             [xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]
         ]]
+
+        bands = [data.GetRasterBand(i + 1) for i in range(data.RasterCount)]
+        overviews = []
+        if bands:
+            for i in range(bands[0].GetOverviewCount()):
+                overview = bands[0].GetOverview(i)
+                overviews.append(
+                    int(round(float(num_cols) / overview.XSize)))
+
         metadata = {
             'bounds': {
                 'coordinates': coords
             },
             'height': data.RasterYSize,
-            'width': data.RasterXSize
+            'width': data.RasterXSize,
+            'geotransform': list(gt),
+            'band_count': data.RasterCount,
+            'dtypes': [gdal.GetDataTypeName(b.DataType) for b in bands],
+            'nodata': [b.GetNoDataValue() for b in bands],
+            'crs': data.GetProjection(),
+            'epsg': _get_dataset_epsg(data),
+            'overviews': overviews
         }
         # print('metadata: {}'.format(metadata))
         dataObject.set_metadata(metadata)
+        dataObject._datatype = types.RASTER
+        dataObject._dataformat = formats.RASTER
 
     def load_data(self, dataObject):
         self.__read_internal(dataObject)
 
-    def __read_internal(self, dataObject):
+    def __open(self):
         if self.ext not in formats.RASTER:
             raise UnsupportedFormatException(
                 "Only the following raster formats are supported: {}".format(
@@ -140,12 +175,18 @@ class GaiaGDALReader(GaiaReader):
             )
         self.basename = os.path.basename(self.uri)
 
-        dataObject.set_data(gdal.Open(self.uri))
+        return gdal.Open(self.uri)
+
+    def __read_internal(self, dataObject):
+        dataObject.set_data(self.__open())
 
         if self.epsg and dataObject.get_epsg() != self.epsg:
-            dataObject.reproject(self.epsg)
+            # Part of reading, unlike GDALDataObject.reproject: the reader's
+            # epsg is already in the data's cache fingerprint
+            dataObject.set_data(
+                gdal_reproject(dataObject._data, '', epsg=self.epsg))
+            dataObject.epsg = self.epsg
 
-        dataObject.set_metadata({})
         dataObject._datatype = types.RASTER
         dataObject._dataformat = formats.RASTER
 
@@ -153,3 +194,14 @@ class GaiaGDALReader(GaiaReader):
             raise UnhandledOperationException('Convert GDAL dataset to numpy')
             # np_data = raster_to_numpy_array(out_data, as_single_band,
             #                                 old_nodata, new_nodata)
+
+
+def _get_dataset_epsg(dataset):
+    """
+    Return the EPSG code of a GDAL dataset's projection, or None
+    """
+    projection = dataset.GetProjection()
+    if not projection:
+        return None
+    code = osr.SpatialReference(wkt=projection).GetAttrValue('AUTHORITY', 1)
+    return int(code) if code else None
@@ -5,6 +5,7 @@ from builtins import (
 
 import re
 from six import string_types
+import fiona
 import geojson
 import geopandas
 
@@ -24,7 +25,13 @@ import gaia.types as types
 class GaiaGeoJSONReader(GaiaReader):
     """
     Another specific subclass for reading GeoJSON
+
+    Passing a chunk_size keyword argument streams files instead of loading
+    them: processes and writers that support it then read the features as
+    GeoDataFrames of chunk_size rows through iter_chunks().
     """
+    datatype = types.VECTOR
+    container = geopandas.GeoDataFrame
     epsgRegex = re.compile('epsg:([\d]+)')
 
     def __init__(self, data_source, *args, **kwargs):
@@ -33,6 +40,7 @@ class GaiaGeoJSONReader(GaiaReader):
         self.geojson_object = None
         self.uri = None
         self.ext = None
+        self.chunk_size = kwargs.get('chunk_size')
 
         if isinstance(data_source, string_types):
             self.uri = data_source
@@ -45,6 +53,9 @@ class GaiaGeoJSONReader(GaiaReader):
         if isinstance(data_source, string_types):
             # Check string for a supported filename/url
             extension = '.{}'.format(get_uri_extension(data_source))
+            if extension in formats.PARQUET + formats.FEATHER:
+                # Read by GaiaGeoParquetReader
+                return False
             if extension in formats.VECTOR:
                 return True
             return False
@@ -55,21 +66,97 @@ class GaiaGeoJSONReader(GaiaReader):
         return super().read(format, epsg)
 
     def load_metadata(self, dataObject):
-        self.__read_internal(dataObject)
+        data = dataObject._data
+        if data is None and self.uri:
+            # Bounds and CRS come from the OGR layer, without building
+            # a GeoDataFrame out of every feature in the file
+            self.__check_format()
+            with fiona.open(self.uri) as collection:
+                bounds = collection.bounds
+                crs = collection.crs
+        else:
+            if data is None:
+                data = self.__read_internal()
+                dataObject.set_data(data)
+            bounds = data.total_bounds
+            crs = data.crs
+
+        self.__set_metadata(dataObject, bounds)
+        self.__set_properties(dataObject, crs)
 
     def load_data(self, dataObject):
-        self.__read_internal(dataObject)
+        data = self.__read_internal()
+        dataObject.set_data(data)
 
-    def __read_internal(self, dataObject):
+        # Metadata read beforehand describes the same file
+        if not dataObject._metadata:
+            self.__set_metadata(dataObject, data.total_bounds)
+        self.__set_properties(dataObject, data.crs)
+
+    def iter_chunks(self, dataObject, chunk_size=None, bbox=None):
+        """
+        Yield the features as GeoDataFrames of at most chunk_size rows.
+
+        Files are read one feature at a time through fiona, so only the
+        current chunk is held in memory, and a bbox is applied as an OGR
+        spatial filter. Rows are numbered in read order, which without a
+        bbox is the feature position, as with a full read.
+
+        :param dataObject: GaiaDataObject being read
+        :param chunk_size: number of features per chunk (default is the
+        reader's chunk size)
+        :param bbox: (minx, miny, maxx, maxy) the features must intersect
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if dataObject._data is not None or not self.uri or not chunk_size:
+            for chunk in super(GaiaGeoJSONReader, self).iter_chunks(
+                    dataObject, chunk_size, bbox):
+                yield chunk
+            return
+
+        self.__check_format()
+        with fiona.open(self.uri) as collection:
+            crs = collection.crs_wkt or collection.crs
+            columns = list(collection.schema['properties']) + ['geometry']
+            if not dataObject._metadata:
+                self.__set_metadata(dataObject, collection.bounds)
+            self.__set_properties(dataObject, collection.crs)
+
+            if bbox is None:
+                features = iter(collection)
+            else:
+                features = (record for fid, record in
+                            collection.items(bbox=tuple(bbox)))
+            start = 0
+            records = []
+            for record in features:
+                records.append(record)
+                if len(records) == chunk_size:
+                    yield self.__make_chunk(records, columns, crs, start)
+                    start += len(records)
+                    records = []
+            if records or not start:
+                yield self.__make_chunk(records, columns, crs, start)
+
+    def __make_chunk(self, records, columns, crs, start):
+        chunk = geopandas.GeoDataFrame.from_features(
+            records, crs=crs, columns=columns)
+        chunk.index += start
+        return chunk
+
+    def __check_format(self):
+        if self.ext not in formats.VECTOR:
+            tpl = "Only the following vector formats are supported: {}"
+            msg = tpl.format(','.join(formats.VECTOR))
+            raise UnsupportedFormatException(msg)
+
+    def __read_internal(self):
         # FIXME: need to handle format
         # if not self.format:
         #     self.format = self.default_output
 
         if self.uri:
-            if self.ext not in formats.VECTOR:
-                tpl = "Only the following vector formats are supported: {}"
-                msg = tpl.format(','.join(formats.VECTOR))
-                raise UnsupportedFormatException(msg)
+            self.__check_format()
             data = geopandas.read_file(self.uri)
 
         elif self.geojson_object:
@@ -95,17 +182,14 @@ class GaiaGeoJSONReader(GaiaReader):
         # FIXME: skipped the transformation step for now
         # return self.transform_data(format, epsg)
 
+        return data
+
+    def __set_metadata(self, dataObject, bounds):
         # Initialize metadata
         metadata = dict()
 
-        # Calculate bounds
-        feature_bounds = data.bounds
-        minx = feature_bounds['minx'].min()
-        miny = feature_bounds['miny'].min()
-        maxx = feature_bounds['maxx'].max()
-        maxy = feature_bounds['maxy'].max()
-
         # Hack format to match resonant geodata (geojson polygon)
+        minx, miny, maxx, maxy = bounds
         coords = [[
             [minx, miny], [], [maxx, maxy], []
         ]]
@@ -113,11 +197,25 @@ class GaiaGeoJSONReader(GaiaReader):
 
         dataObject.set_metadata(metadata)
 
-        dataObject.set_data(data)
-        epsgString = data.crs['init']
-
-        m = self.epsgRegex.search(epsgString)
-        if m:
-            dataObject._epsg = int(m.group(1))
+    def __set_properties(self, dataObject, crs):
+        epsg = self.__get_epsg(crs)
+        if epsg is not None:
+            dataObject._epsg = epsg
         dataObject._datatype = types.VECTOR
         dataObject._dataformat = formats.VECTOR
+
+    def __get_epsg(self, crs):
+        """
+        Extract the EPSG code from a CRS, which depending on the fiona and
+        geopandas versions is a dict, a string or a CRS object.
+        """
+        if crs is None:
+            return None
+        if hasattr(crs, 'to_epsg'):
+            return crs.to_epsg()
+        if isinstance(crs, dict):
+            crs = crs.get('init', '')
+        m = self.epsgRegex.search(str(crs).lower())
+        if m:
+            return int(m.group(1))
+        return None
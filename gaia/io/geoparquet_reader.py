@@ -0,0 +1,148 @@
+from __future__ import absolute_import, division, print_function
+from builtins import (
+    bytes, str, open, super, range, zip, round, input, int, pow, object
+)
+
+import json
+from six import string_types
+import geopandas
+
+# Are pyarrow and pyproj available?
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet
+    from pyproj import CRS
+    IS_PYARROW_LOADED = True
+except ImportError:
+    IS_PYARROW_LOADED = False
+
+from gaia.io.gaia_reader import GaiaReader
+from gaia.gaia_data import GaiaDataObject
+from gaia.util import (
+    UnsupportedFormatException,
+    get_uri_extension
+)
+import gaia.formats as formats
+import gaia.types as types
+
+
+class GaiaGeoParquetReader(GaiaReader):
+    """
+    A specific subclass for reading GeoParquet and Feather (Arrow IPC) files
+
+    Reading can be restricted to some columns with a columns keyword
+    argument, the geometry column being always read, and to the features
+    intersecting a (minx, miny, maxx, maxy) bbox keyword argument. For
+    GeoParquet files written with a bbox covering column, as gaia.save
+    does, the bbox skips the row groups outside of it.
+    """
+    datatype = types.VECTOR
+    container = geopandas.GeoDataFrame
+
+    def __init__(self, data_source, *args, **kwargs):
+        super(GaiaGeoParquetReader, self).__init__(*args, **kwargs)
+
+        self.uri = data_source
+        self.ext = '.%s' % get_uri_extension(self.uri)
+        self.columns = kwargs.get('columns')
+        self.bbox = kwargs.get('bbox')
+
+    @staticmethod
+    def can_read(data_source, *args, **kwargs):
+        if not IS_PYARROW_LOADED:
+            return False
+        if isinstance(data_source, string_types):
+            extension = '.{}'.format(get_uri_extension(data_source))
+            return extension in formats.PARQUET + formats.FEATHER
+        return False
+
+    def read(self, format=None, epsg=None):
+        return GaiaDataObject(reader=self, dataFormat=format, epsg=epsg)
+
+    def load_metadata(self, dataObject):
+        """
+        Describe the file from the GeoParquet metadata of its schema,
+        without reading any rows when it records the bounds of the data.
+        """
+        geo = self.__read_geo_metadata()
+        column = geo.get('columns', {}).get(geo.get('primary_column'), {})
+        bounds = column.get('bbox')
+        if dataObject._data is not None or self.bbox or not bounds:
+            data = dataObject.get_data()
+            bounds = data.total_bounds
+        self.__set_metadata(dataObject, bounds)
+        self.__set_properties(dataObject, column)
+
+    def load_data(self, dataObject):
+        data = self.__read_internal()
+        dataObject.set_data(data)
+
+        if not dataObject._metadata:
+            self.__set_metadata(dataObject, data.total_bounds)
+        dataObject._epsg = data.crs.to_epsg() if data.crs else None
+        dataObject._datatype = types.VECTOR
+        dataObject._dataformat = formats.VECTOR
+
+    def __is_parquet(self):
+        return self.ext in formats.PARQUET
+
+    def __read_geo_metadata(self):
+        if self.ext not in formats.PARQUET + formats.FEATHER:
+            raise UnsupportedFormatException(
+                "Only the following columnar formats are supported: {}".format(
+                    ','.join(formats.PARQUET + formats.FEATHER)))
+        if self.__is_parquet():
+            schema = pyarrow.parquet.read_schema(self.uri)
+        else:
+            schema = pyarrow.ipc.open_file(self.uri).schema
+        metadata = schema.metadata or {}
+        return json.loads(metadata.get(b'geo', b'{}').decode('utf-8'))
+
+    def __read_internal(self):
+        columns = self.columns
+        if columns is not None:
+            primary_column = self.__read_geo_metadata().get('primary_column')
+            columns = list(columns)
+            if primary_column and primary_column not in columns:
+                columns.append(primary_column)
+
+        if self.__is_parquet() and self.bbox is not None:
+            try:
+                # Skips the row groups outside of the bbox
+                return geopandas.read_parquet(
+                    self.uri, columns=columns, bbox=tuple(self.bbox))
+            except (TypeError, ValueError):
+                # Older geopandas, or no bbox covering column in the file
+                pass
+
+        if self.__is_parquet():
+            data = geopandas.read_parquet(self.uri, columns=columns)
+        else:
+            data = geopandas.read_feather(self.uri, columns=columns)
+        if self.bbox is not None:
+            minx, miny, maxx, maxy = self.bbox
+            data = data.cx[minx:maxx, miny:maxy]
+        return data
+
+    def __set_metadata(self, dataObject, bounds):
+        # Same bounds format as the GeoJSON reader
+        minx, miny, maxx, maxy = bounds
+        coords = [[
+            [minx, miny], [], [maxx, maxy], []
+        ]]
+        dataObject.set_metadata(dict(bounds=dict(coordinates=coords)))
+
+    def __set_properties(self, dataObject, column):
+        if dataObject._data is not None:
+            crs = dataObject._data.crs
+            epsg = crs.to_epsg() if crs else None
+        else:
+            # A GeoParquet column without crs is in OGC:CRS84 (lon/lat)
+            crs = column.get('crs', 4326)
+            epsg = None
+            if crs is not None:
+                epsg = CRS.from_user_input(crs).to_epsg()
+        if epsg is not None:
+            dataObject._epsg = epsg
+        dataObject._datatype = types.VECTOR
+        dataObject._dataformat = formats.VECTOR
@@ -3,6 +3,13 @@ from builtins import (
     bytes, str, open, super, range, zip, round, input, int, pow, object
 )
 
+import uuid
+
+import fiona
+import geopandas
+import pandas
+from shapely import wkb
+
 from gaia.gaia_data import PostgisDataObject
 from gaia.io.readers import GaiaReader
 
@@ -11,28 +18,98 @@ import gaia.formats as formats
 
 
 class GaiaPostGISReader(GaiaReader):
+    datatype = types.VECTOR
+    container = geopandas.GeoDataFrame
+
     required_arguments = ['table', 'dbname', 'hostname', 'user', 'password']
+    optional_arguments = ['itersize']
 
     def __init__(self, *args, **kwargs):
         super(GaiaPostGISReader, self).__init__(*args, **kwargs)
         self._args = args
         self._kwargs = kwargs
+        self.chunk_size = kwargs.get('chunk_size')
 
     def read(self, format=None, epsg=None):
         print('GaiaPostGISReader read()')
         dataObject = PostgisDataObject(reader=self)
         dataObject.format = format
         dataObject.epsg = epsg
+        if 'itersize' in self._kwargs:
+            dataObject.itersize = self._kwargs['itersize']
         return dataObject
 
     def load_metadata(self, dataObject):
         self.__set_db_properties(dataObject)
 
     def load_data(self, dataObject):
+        """
+        Read the whole table into a GeoDataFrame.  Processes and writers
+        that can work on parts of the table stream it with iter_chunks()
+        instead.
+        """
+        chunks = list(self.iter_chunks(dataObject))
+        if len(chunks) == 1:
+            data = chunks[0]
+        else:
+            data = geopandas.GeoDataFrame(
+                pandas.concat(chunks, ignore_index=True),
+                geometry=dataObject.geom_column, crs=chunks[0].crs)
+        dataObject.set_data(data)
+
+    def iter_chunks(self, dataObject, chunk_size=None, bbox=None):
+        """
+        Query the table in batches of chunk_size rows, each returned as a
+        GeoDataFrame, so the table never has to fit in memory at once.
+
+        Rows are fetched through a named (server-side) cursor: the result
+        set stays on the server and is transferred itersize rows at a time,
+        with geometries as binary WKB.
+
+        :param dataObject: PostgisDataObject being read
+        :param chunk_size: number of rows per chunk (default is the reader's
+        chunk size, or the data object's itersize)
+        :param bbox: (minx, miny, maxx, maxy) in the table's coordinates,
+        the geometries' bounding boxes must intersect
+        :return: generator of GeoDataFrames
+        """
         self.__set_db_properties(dataObject)
+        chunk_size = chunk_size or self.chunk_size or dataObject.itersize
+        query, params = dataObject.get_query(bbox=bbox, wkb=True)
+
+        connection = dataObject.engine.raw_connection()
+        try:
+            cursor = connection.cursor(
+                name='gaia_{}'.format(uuid.uuid4().hex))
+            cursor.itersize = dataObject.itersize
+            cursor.execute(query.rstrip(';'), params)
+            rows = []
+            yielded = False
+            for row in cursor:
+                rows.append(row)
+                if len(rows) == chunk_size:
+                    yield self.__to_geodataframe(dataObject, cursor, rows)
+                    rows = []
+                    yielded = True
+            if rows or not yielded:
+                yield self.__to_geodataframe(dataObject, cursor, rows)
+            cursor.close()
+        finally:
+            connection.close()
+
+    def __to_geodataframe(self, dataObject, cursor, rows):
+        columns = [column[0] for column in cursor.description]
+        df = pandas.DataFrame.from_records(rows, columns=columns)
+        geom_column = dataObject.geom_column
+        df[geom_column] = [wkb.loads(bytes(g)) if g is not None else None
+                           for g in df[geom_column]]
+        crs = None
+        if dataObject.get_epsg():
+            crs = fiona.crs.from_epsg(dataObject.get_epsg())
+        return geopandas.GeoDataFrame(df, geometry=geom_column, crs=crs)
 
     def __set_db_properties(self, dataObject):
-        for key in self.required_arguments:
+        for key in self.required_arguments + self.optional_arguments:
             if key in self._kwargs:
                 print('  Setting property %s to %s' % (key, self._kwargs[key]))
                 setattr(dataObject, key, self._kwargs[key])
@@ -0,0 +1,210 @@
+from __future__ import absolute_import, division, print_function
+from builtins import (
+    bytes, str, open, super, range, zip, round, input, int, pow, object
+)
+
+import io
+import struct
+
+import pandas
+
+from gaia.util import GaiaException, sqlengines
+
+#: Signature, flags and header extension length of binary COPY data
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+#: Field count marking the end of binary COPY data
+COPY_TRAILER = struct.pack('>h', -1)
+#: Microseconds between the Unix and PostgreSQL (2000-01-01) epochs
+POSTGRES_EPOCH_OFFSET = 946684800000000
+#: EWKB flag for geometries carrying a SRID
+EWKB_SRID_FLAG = 0x20000000
+
+
+def is_postgis_uri(uri):
+    """
+    Check whether a gaia.save target is a PostgreSQL database URL
+    """
+    return uri.startswith(('postgresql://', 'postgres://'))
+
+
+def write_postgis_object(gaia_object, uri, table=None, if_exists='fail',
+                         chunk_size=10000, defer_index=True,
+                         geom_column=None):
+    """
+    Write vector data to a PostGIS table with binary COPY.
+
+    Rows are streamed to the server in COPY ... FROM STDIN (FORMAT binary)
+    batches of chunk_size rows, geometries being sent as EWKB, and each
+    batch is committed on its own.  Streamed data objects are written one
+    chunk at a time.  The table is created with a column per data column
+    (bigint, double precision, boolean, timestamp, timestamptz or text)
+    and a geometry column; appending requires an existing table with
+    those types.
+
+    :param gaia_object: GaiaDataObject with GeoDataFrame data
+    :param uri: PostgreSQL database URL
+    :param table: name of the table, optionally with its schema
+    :param if_exists: 'fail', 'replace' or 'append' when the table exists
+    :param chunk_size: number of rows per COPY batch and commit
+    :param defer_index: create the spatial index of a new table after
+    loading the rows instead of before
+    :param geom_column: name of the geometry column (default is the name
+    of the GeoDataFrame's geometry column)
+    """
+    if not table:
+        raise GaiaException('A table is required to write to PostGIS')
+    if if_exists not in ('fail', 'replace', 'append'):
+        raise GaiaException('Invalid value for if_exists')
+
+    if gaia_object.get_chunk_size():
+        chunks = gaia_object.iter_chunks()
+    else:
+        chunks = gaia_object.iter_chunks(chunk_size=chunk_size)
+    srid = gaia_object.get_epsg()
+    table_sql = '.'.join('"{}"'.format(p) for p in table.split('.'))
+
+    connection = sqlengines.get_engine(uri).raw_connection()
+    try:
+        cursor = connection.cursor()
+        created = False
+        index_sql = None
+        for chunk in chunks:
+            geometry_name = chunk.geometry.name
+            columns = [c for c in chunk.columns if c != geometry_name]
+            column_names = columns + [geom_column or geometry_name]
+            if not created:
+                if _prepare_table(cursor, table_sql, if_exists, chunk,
+                                  columns, column_names[-1], srid):
+                    index_sql = 'CREATE INDEX ON {} USING GIST ("{}")'.format(
+                        table_sql, column_names[-1])
+                    if not defer_index:
+                        cursor.execute(index_sql)
+                        index_sql = None
+                connection.commit()
+                created = True
+
+            for start in range(0, len(chunk), chunk_size):
+                rows = chunk.iloc[start:start + chunk_size]
+                cursor.copy_expert(
+                    'COPY {} ({}) FROM STDIN WITH (FORMAT binary)'.format(
+                        table_sql,
+                        ','.join('"{}"'.format(c) for c in column_names)),
+                    _copy_data(rows, columns, geometry_name, srid))
+                connection.commit()
+
+        if index_sql:
+            cursor.execute(index_sql)
+        if created:
+            cursor.execute('ANALYZE {}'.format(table_sql))
+        connection.commit()
+        cursor.close()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def _prepare_table(cursor, table_sql, if_exists, chunk, columns,
+                   geom_column, srid):
+    """
+    Create the table written to, unless it exists and is appended to
+
+    :return: whether the table was created
+    """
+    cursor.execute('SELECT to_regclass(%s)', (table_sql,))
+    exists = cursor.fetchone()[0] is not None
+    if exists and if_exists == 'fail':
+        raise GaiaException('Table {} exists'.format(table_sql))
+    if exists and if_exists == 'append':
+        return False
+    if exists:
+        cursor.execute('DROP TABLE {}'.format(table_sql))
+    _create_table(cursor, table_sql, chunk, columns, geom_column, srid)
+    return True
+
+
+def _create_table(cursor, table_sql, chunk, columns, geom_column, srid):
+    definitions = ['"{}" {}'.format(c, _column_type(chunk[c].dtype))
+                   for c in columns]
+    geom_type = 'geometry(Geometry, {})'.format(int(srid)) if srid else (
+        'geometry')
+    definitions.append('"{}" {}'.format(geom_column, geom_type))
+    cursor.execute('CREATE TABLE {} ({})'.format(
+        table_sql, ', '.join(definitions)))
+
+
+def _column_type(dtype):
+    """
+    Return the PostgreSQL type a numpy or pandas dtype is written as
+    """
+    if getattr(dtype, 'tz', None) is not None:
+        # pandas DatetimeTZDtype, its values are sent as UTC instants
+        return 'timestamptz'
+    return {
+        'b': 'boolean',
+        'i': 'bigint',
+        'u': 'bigint',
+        'f': 'double precision',
+        'M': 'timestamp',
+    }.get(dtype.kind, 'text')
+
+
+def _copy_data(rows, columns, geometry_name, srid):
+    """
+    Encode GeoDataFrame rows in the binary COPY format
+
+    :return: file-like object
+    """
+    encoders = [_field_encoder(rows[c].dtype) for c in columns]
+    encoders.append(lambda geometry: _ewkb(geometry.wkb, srid))
+    field_count = struct.pack('>h', len(encoders))
+
+    buf = io.BytesIO()
+    buf.write(COPY_HEADER)
+    for row in zip(*([rows[c] for c in columns] + [rows[geometry_name]])):
+        buf.write(field_count)
+        for encode, value in zip(encoders, row):
+            if _is_null(value):
+                buf.write(struct.pack('>i', -1))
+            else:
+                data = encode(value)
+                buf.write(struct.pack('>i', len(data)))
+                buf.write(data)
+    buf.write(COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def _field_encoder(dtype):
+    kind = dtype.kind
+    if kind == 'b':
+        return lambda v: struct.pack('>?', bool(v))
+    if kind in 'iu':
+        return lambda v: struct.pack('>q', int(v))
+    if kind == 'f':
+        return lambda v: struct.pack('>d', float(v))
+    if kind == 'M':
+        # Timestamps are microseconds since the PostgreSQL epoch
+        return lambda v: struct.pack(
+            '>q', v.value // 1000 - POSTGRES_EPOCH_OFFSET)
+    return lambda v: str(v).encode('utf-8')
+
+
+def _is_null(value):
+    # None, NaN, NaT and pandas.NA; sequences are values, not nulls
+    null = pandas.isna(value)
+    return null if isinstance(null, bool) else False
+
+
+def _ewkb(wkb, srid):
+    """
+    Add a SRID to a WKB geometry, making it EWKB
+    """
+    wkb = bytes(wkb)
+    if not srid:
+        return wkb
+    order = '<' if bytearray(wkb[:1])[0] == 1 else '>'
+    geom_type, = struct.unpack(order + 'I', wkb[1:5])
+    return (wkb[:1] + struct.pack(order + 'I', geom_type | EWKB_SRID_FLAG) +
+            struct.pack(order + 'I', int(srid)) + wkb[5:])
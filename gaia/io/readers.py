@@ -1,4 +1,5 @@
 from gaia.io.gaia_reader import GaiaReader
 from gaia.io.geojson_reader import GaiaGeoJSONReader
+from gaia.io.geoparquet_reader import GaiaGeoParquetReader
 from gaia.io.gdal_reader import GaiaGDALReader
 from gaia.io.girder_reader import GirderReader
@@ -1,4 +1,5 @@
 from __future__ import absolute_import, division, print_function
+import json
 import os
 
 try:
@@ -7,12 +8,16 @@ except ImportError:
     from osgeo import osr
 
 import gdal
+import fiona
 import geopandas
+import pandas
+from geopandas.io.file import infer_schema
 
 
 from gaia import types
 from gaia.gaia_data import GaiaDataObject
 from gaia.util import GaiaException
+from gaia.io.postgis_writer import is_postgis_uri, write_postgis_object
 
 # Map of <file-extension, driver-name> for GeoPandas
 GEOPANDAS_DRIVERS = {
@@ -21,6 +26,14 @@ GEOPANDAS_DRIVERS = {
     '.shp': 'ESRI Shapefile'
 }
 
+# Map of <file-extension, GeoDataFrame method> for columnar formats
+COLUMNAR_WRITERS = {
+    '.arrow': 'to_feather',
+    '.feather': 'to_feather',
+    '.geoparquet': 'to_parquet',
+    '.parquet': 'to_parquet'
+}
+
 # Map of <file-extension, driver-name> for GDAL
 GDAL_DRIVERS = {
     '.geotiff': 'GTiff',
@@ -36,6 +49,10 @@ def write_gaia_object(gaia_object, filename, **options):
         raise GaiaException('Writing not supported for GirderDataObject')
 
     data_type = gaia_object._getdatatype()
+    if is_postgis_uri(filename):
+        if data_type != types.VECTOR:
+            raise GaiaException('Only vector data can be written to PostGIS')
+        return write_postgis_object(gaia_object, filename, **options)
     if data_type == types.VECTOR:
         return write_vector_object(gaia_object, filename, **options)
     elif data_type == types.RASTER:
@@ -49,17 +66,160 @@ def write_vector_object(gaia_object, filename, **options):
     if os.path.exists(filename):
         os.remove(filename)
 
-    data = gaia_object.get_data()
     ext = os.path.splitext(filename)[1]
     if ext == '':
         ext = '.geojson'  # default
+    if ext in COLUMNAR_WRITERS:
+        return write_columnar_object(gaia_object, filename, ext, **options)
     driver = GEOPANDAS_DRIVERS.get(ext)
     if driver is None:
         raise GaiaException('Unsupported file extension {}'.format(ext))
+
+    if gaia_object.get_chunk_size():
+        write_vector_chunks(gaia_object.iter_chunks(), filename, driver,
+                            **options)
+        return
+    data = gaia_object.get_data()
     data.to_file(filename, driver, **options)
 
 
-def write_raster_object(gaia_object, filename, **options):
+def write_columnar_object(gaia_object, filename, ext, **options):
+    """
+    Write vector data to a GeoParquet or Feather file.  GeoParquet files
+    get a bbox covering column, so that readers can skip the row groups
+    outside of a bbox.  Streamed data is written one chunk at a time.
+
+    :param gaia_object: GaiaDataObject with GeoDataFrame data
+    :param filename: filesystem path
+    :param ext: file extension, a key of COLUMNAR_WRITERS
+    :param options: options to pass to the GeoDataFrame writing method,
+    or for streamed data to pyarrow's ParquetWriter or IpcWriteOptions
+    """
+    if gaia_object.get_chunk_size():
+        if hasattr(geopandas.GeoDataFrame, 'to_arrow'):
+            return write_columnar_chunks(
+                gaia_object.iter_chunks(), filename, ext, **options)
+        # geopandas < 1.0
+        chunks = list(gaia_object.iter_chunks())
+        data = geopandas.GeoDataFrame(
+            pandas.concat(chunks), crs=chunks[0].crs)
+    else:
+        data = gaia_object.get_data()
+    write = getattr(data, COLUMNAR_WRITERS[ext])
+    if COLUMNAR_WRITERS[ext] == 'to_parquet':
+        try:
+            return write(filename, write_covering_bbox=True, **options)
+        except TypeError:
+            # geopandas < 1.0
+            pass
+    write(filename, **options)
+
+
+def write_columnar_chunks(chunks, filename, ext, **options):
+    """
+    Write GeoDataFrame chunks to a single GeoParquet or Feather file, one
+    chunk (a Parquet row group or an Arrow record batch) at a time.  The
+    schema is the one of the first chunk.
+
+    :param chunks: iterable of GeoDataFrames with the same columns
+    :param filename: filesystem path
+    :param ext: file extension, a key of COLUMNAR_WRITERS
+    :param options: options to pass to pyarrow's ParquetWriter or
+    IpcWriteOptions
+    """
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    parquet = COLUMNAR_WRITERS[ext] == 'to_parquet'
+    writer = None
+    try:
+        for chunk in chunks:
+            table = _geoarrow_table(chunk, covering=parquet)
+            if writer is None:
+                schema = table.schema
+                if parquet:
+                    writer = pyarrow.parquet.ParquetWriter(
+                        filename, schema, **options)
+                else:
+                    writer = pyarrow.ipc.new_file(
+                        filename, schema,
+                        options=pyarrow.ipc.IpcWriteOptions(**options))
+            else:
+                table = table.cast(schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _geoarrow_table(chunk, covering=False):
+    """
+    Convert a GeoDataFrame to an Arrow table with WKB geometries and
+    GeoParquet metadata, optionally with a bbox covering column
+    """
+    import pyarrow
+
+    geometry = chunk.geometry.name
+    table = pyarrow.table(chunk.to_arrow(index=False,
+                                         geometry_encoding='WKB'))
+    column = {'encoding': 'WKB', 'geometry_types': []}
+    if chunk.crs is not None:
+        column['crs'] = chunk.crs.to_json_dict()
+    if covering:
+        bounds = chunk.geometry.bounds
+        names = ['xmin', 'ymin', 'xmax', 'ymax']
+        table = table.append_column('bbox', pyarrow.StructArray.from_arrays(
+            [pyarrow.array(bounds[c].values, pyarrow.float64())
+             for c in ('minx', 'miny', 'maxx', 'maxy')], names=names))
+        column['covering'] = {
+            'bbox': dict((name, ['bbox', name]) for name in names)}
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps({
+        'version': '1.1.0',
+        'primary_column': geometry,
+        'columns': {geometry: column}
+    }).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+
+def write_vector_chunks(chunks, filename, driver, **options):
+    """
+    Write GeoDataFrame chunks to a single vector file, one chunk at a time.
+    The schema is inferred from the first chunk.
+
+    :param chunks: iterable of GeoDataFrames with the same columns
+    :param filename: filesystem path
+    :param driver: OGR driver name
+    :param options: options to pass to fiona
+    """
+    collection = None
+    try:
+        for chunk in chunks:
+            if collection is None:
+                crs = chunk.crs
+                if hasattr(crs, 'to_wkt'):
+                    options.setdefault('crs_wkt', crs.to_wkt())
+                else:
+                    options.setdefault('crs', crs)
+                collection = fiona.open(
+                    filename, 'w', driver=driver,
+                    schema=infer_schema(chunk), **options)
+            collection.writerecords(chunk.iterfeatures())
+    finally:
+        if collection is not None:
+            collection.close()
+
+
+def write_raster_object(gaia_object, filename, cog=False, **options):
+    """
+    Write raster data to a file.
+
+    :param gaia_object: GaiaDataObject with a GDAL dataset
+    :param filename: filesystem path
+    :param cog: write a Cloud-Optimized GeoTIFF (see write_cog)
+    :param options: options of write_cog
+    """
     # Delete existing file (if any)
     if os.path.exists(filename):
         os.remove(filename)
@@ -71,13 +231,88 @@ def write_raster_object(gaia_object, filename, **options):
     if driver_name is None:
         raise GaiaException('Unsupported file extension {}'.format(ext))
 
+    gdal_dataset = gaia_object.get_data()
+    if cog:
+        if driver_name != 'GTiff':
+            raise GaiaException('Cloud-Optimized GeoTIFF requires a '
+                                'GeoTIFF file extension')
+        return write_cog(gdal_dataset, filename, **options)
+
     # Have to create copy of dataset in order to write to file
     driver = gdal.GetDriverByName(driver_name)
     if driver is None:
         raise GaiaException('GDAL driver {} not found'.format(driver_name))
 
-    gdal_dataset = gaia_object.get_data()
     output_dataset = driver.CreateCopy(filename, gdal_dataset, strict=0)
     # Setting the dataset to None causes the write to disk
     # Add # noqa comment to ignore flake8 error that variable isn't used
     output_dataset = None  # writes to disk  # noqa: F841
+
+
+def write_cog(gdal_dataset, filename, compress='DEFLATE', predictor=None,
+              blocksize=512, num_threads='ALL_CPUS', resampling='AVERAGE'):
+    """
+    Write a GDAL dataset as a Cloud-Optimized GeoTIFF: internally tiled,
+    compressed, with overviews stored before the full resolution data.
+
+    The COG driver is used when GDAL has it (3.1+). Otherwise overviews
+    are built on a temporary tiled GeoTIFF, which is then copied with
+    COPY_SRC_OVERVIEWS.
+
+    :param gdal_dataset: GDAL dataset to write
+    :param filename: filesystem path
+    :param compress: compression method, such as DEFLATE, ZSTD or LZW
+    :param predictor: compression predictor, by default 2 (horizontal
+    differencing) for integer data and 3 (floating point) for float data
+    :param blocksize: size in pixels of the square tiles
+    :param num_threads: number of threads compressing tiles, or ALL_CPUS
+    :param resampling: resampling method of the overviews
+    """
+    options = [
+        'COMPRESS={}'.format(compress.upper()),
+        'NUM_THREADS={}'.format(num_threads),
+    ]
+    if compress.upper() in ('DEFLATE', 'ZSTD', 'LZW', 'LZMA'):
+        if predictor is None:
+            data_type = gdal_dataset.GetRasterBand(1).DataType
+            is_float = data_type in (gdal.GDT_Float32, gdal.GDT_Float64)
+            predictor = 3 if is_float else 2
+        options.append('PREDICTOR={}'.format(predictor))
+
+    cog_driver = gdal.GetDriverByName('COG')
+    if cog_driver is not None:
+        options += [
+            'BLOCKSIZE={}'.format(blocksize),
+            'OVERVIEW_RESAMPLING={}'.format(resampling.upper()),
+        ]
+        output_dataset = cog_driver.CreateCopy(
+            filename, gdal_dataset, strict=0, options=options)
+        output_dataset = None  # writes to disk  # noqa: F841
+        return
+
+    # Overview factors, halving the size until it fits in a tile
+    levels = []
+    size = max(gdal_dataset.RasterXSize, gdal_dataset.RasterYSize)
+    while size / (2 ** len(levels)) > blocksize:
+        levels.append(2 ** (len(levels) + 1))
+
+    driver = gdal.GetDriverByName('GTiff')
+    tile_options = ['TILED=YES',
+                    'BLOCKXSIZE={}'.format(blocksize),
+                    'BLOCKYSIZE={}'.format(blocksize)]
+    source = gdal_dataset
+    tmp_filename = None
+    if levels:
+        tmp_filename = '{}.tmp{}'.format(*os.path.splitext(filename))
+        source = driver.CreateCopy(tmp_filename, gdal_dataset, strict=0,
+                                   options=tile_options + ['BIGTIFF=IF_SAFER'])
+        source.BuildOverviews(resampling.upper(), levels)
+    try:
+        output_dataset = driver.CreateCopy(
+            filename, source, strict=0,
+            options=tile_options + options + ['COPY_SRC_OVERVIEWS=YES'])
+        output_dataset = None  # writes to disk  # noqa: F841
+    finally:
+        source = None
+        if tmp_filename is not None:
+            driver.Delete(tmp_filename)
@@ -1,4 +1,5 @@
 
+from gaia.preprocess.postgis_processes import *
 from gaia.preprocess.pandas_processes import *
 from gaia.preprocess.gdal_processes import *
 from gaia.preprocess.girder_processes import *
@@ -4,10 +4,10 @@ from builtins import (
 )
 
 from gaia import GaiaException
-from gaia.gaia_data import GDALDataObject
+from gaia.gaia_data import GaiaDataObject, GDALDataObject
 from gaia.validators import validate_subset
 from gaia.process_registry import register_process
-from gaia.geo.gdal_functions import gdal_clip
+from gaia.geo.gdal_functions import gdal_clip, gdal_clip_windowed
 from gaia.io.gdal_reader import GaiaGDALReader
 import gaia.types
 
@@ -23,24 +23,33 @@ def validate_gdal(v):
     return validator
 
 
-@register_process('crop')
+@register_process('crop', inputs=[(GDALDataObject, gaia.types.RASTER),
+                                  (GaiaDataObject, gaia.types.VECTOR)])
 @validate_subset
 @validate_gdal
-def compute_subset_gdal(inputs=[], args=[]):
+def compute_subset_gdal(inputs=[], args={}):
     """
     Runs the subset computation, creating a raster dataset as output.
+
+    By default only the part of the raster under the crop geometry's
+    envelope is read, block by block.  Pass windowed=False to read the
+    whole raster instead, and all_touched=True to keep every pixel the
+    crop geometry touches.
     """
     raster, clip = inputs[0], inputs[1]
     raster_img = raster.get_data()
 
-    if clip.get_epsg() != raster.get_epsg():
-        clip.reproject(raster.get_epsg())
-
-    clip_json = clip.get_data().geometry.unary_union.__geo_interface__
+    clip_json = clip.get_unary_union(epsg=raster.get_epsg()).__geo_interface__
 
     # Passing "None" as second arg instead of a file path.  This tells gdal_clip
     # not to write the output dataset to a tiff file on disk
-    output_dataset = gdal_clip(raster_img, None, clip_json)
+    all_touched = args.get('all_touched', False)
+    if args.get('windowed', True):
+        output_dataset = gdal_clip_windowed(
+            raster_img, None, clip_json, all_touched=all_touched)
+    else:
+        output_dataset = gdal_clip(
+            raster_img, None, clip_json, all_touched=all_touched)
 
     # Copy data to new GDALDataObject
     outputDataObject = GDALDataObject()
@@ -42,7 +42,7 @@ def validate_girder(v):
     return validator
 
 
-@register_process('crop')
+@register_process('crop', inputs=[(GirderDataObject, None), (object, None)])
 @validate_girder
 def compute_girder_crop(inputs=[], args_dict={}):
     """
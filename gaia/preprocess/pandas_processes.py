@@ -10,8 +10,10 @@ from gaia.process_registry import register_process
 from gaia import GaiaException
 from gaia.gaia_data import GaiaDataObject
 
+import numpy
 from geopandas import GeoDataFrame
 from geopandas import GeoSeries
+from pandas import Series, concat
 
 
 def validate_pandas(v):
@@ -22,8 +24,9 @@ def validate_pandas(v):
     processes defined in this module can re-use the same validate method.
     """
     def validator(inputs=[], args={}):
-        # First should check if input is compatible w/ pandas computation
-        if type(inputs[0].get_data()) is not GeoDataFrame:
+        # First should check if input is compatible w/ pandas computation,
+        # from the container type its reader declares, without loading it
+        if not issubclass(inputs[0].get_container(), GeoDataFrame):
             raise GaiaException('pandas process requires a GeoDataFrame')
 
         # Otherwise call up the chain to let parent do common validation
@@ -32,21 +35,59 @@ def validate_pandas(v):
     return validator
 
 
-@register_process('crop')
+def within_indexed(df, geometry):
+    """
+    Find the features of a GeoDataFrame that are within a geometry.
+
+    The features are matched with a single vectorized query on the
+    GeoDataFrame's spatial index, which only evaluates the exact
+    predicate for the features whose bounds intersect the bounds of
+    the geometry.
+
+    :param df: GeoDataFrame to test
+    :param geometry: shapely geometry the features must be within
+    :return: boolean Series aligned with df
+    """
+    if len(df) == 0:
+        return Series([], index=df.index, dtype=bool)
+
+    sindex = df.sindex
+    if sindex is None:
+        # No spatial index backend available
+        return df.geometry.within(geometry)
+
+    mask = numpy.zeros(len(df), dtype=bool)
+    mask[sindex.query(geometry, predicate='contains')] = True
+    return Series(mask, index=df.index)
+
+
+@register_process('crop', inputs=[(GaiaDataObject, gaia.types.VECTOR),
+                                  (GaiaDataObject, gaia.types.VECTOR)])
 @validators.validate_within
 @validate_pandas
 def crop_pandas(inputs=[], args={}):
     """
     Calculate the within process using pandas GeoDataFrames
 
+    Features are matched through the spatial index of the first dataset
+    unless spatial_index=False is passed, in which case every feature is
+    tested against the crop geometry. A first dataset read in streaming
+    mode is cropped one chunk at a time, so only its matching features
+    are held in memory.
+
     :return: within result as a GeoDataFrame
     """
     first, second = inputs[0], inputs[1]
-    if first.get_epsg() != second.get_epsg():
-        second.reproject(epsg=first.get_epsg())
-    first_df, second_df = first.get_data(), second.get_data()
-    first_within = first_df[first_df.geometry.within(
-        second_df.geometry.unary_union)]
+    if first.get_chunk_size():
+        chunks = first.iter_chunks()
+    else:
+        chunks = [first.get_data()]
+    union = second.get_unary_union(epsg=first.get_epsg())
+    if args.get('spatial_index', True):
+        cropped = [chunk[within_indexed(chunk, union)] for chunk in chunks]
+    else:
+        cropped = [chunk[chunk.geometry.within(union)] for chunk in chunks]
+    first_within = cropped[0] if len(cropped) == 1 else concat(cropped)
 
     # Construct GaiaDataObject manually
     # Todo consider adding static method to GaiaDataObject
@@ -0,0 +1,90 @@
+from __future__ import absolute_import, division, print_function
+from builtins import (
+    bytes, str, open, super, range, zip, round, input, int, pow, object
+)
+
+import copy
+
+import gaia.formats
+import gaia.types
+import gaia.validators as validators
+from gaia.process_registry import register_process
+from gaia import GaiaException
+from gaia.gaia_data import GaiaDataObject, PostgisDataObject
+
+from geopandas import GeoDataFrame
+from pandas import concat
+
+
+def validate_postgis(v):
+    """
+    Make sure the first input is a PostGIS table, so the process can run
+    in the database.
+    """
+    def validator(inputs=[], args={}):
+        if not isinstance(inputs[0], PostgisDataObject):
+            raise GaiaException('postgis process requires a PostGIS table')
+
+        predicate = args.get('predicate', 'within')
+        if predicate not in ('within', 'intersects'):
+            raise GaiaException('Invalid value for predicate')
+
+        # Otherwise call up the chain to let parent do common validation
+        return v(inputs, args)
+
+    return validator
+
+
+@register_process('crop', inputs=[(PostgisDataObject, gaia.types.VECTOR),
+                                  (GaiaDataObject, gaia.types.VECTOR)])
+@validators.validate_within
+@validate_postgis
+def crop_postgis(inputs=[], args={}):
+    """
+    Calculate the within process in the database for a PostGIS table
+
+    The crop geometry is sent as a ST_Within (or, with
+    predicate='intersects', ST_Intersects) condition on the table's
+    geometry column, so the spatial index selects the matching rows and
+    only those are fetched.
+
+    :return: within result as a GeoDataFrame
+    """
+    first, second = inputs[0], inputs[1]
+
+    # Query a copy of the table's data object with the crop geometry as
+    # an extra spatial filter.  The geometry is reprojected to the EPSG
+    # code of the filters the table may already have, so that they keep
+    # being transformed from their own projection.
+    cropped = copy.copy(first)
+    cropped.set_data(None)
+    epsg = first.filter_epsg or first.get_epsg()
+    cropped.spatial_filters = list(first.spatial_filters or []) + [(
+        first.geom_column, args.get('predicate', 'within'),
+        second.get_unary_union(epsg=epsg))]
+    # The cropped rows are fetched in chunks through a server-side cursor
+    chunks = list(cropped.iter_chunks())
+    if len(chunks) == 1:
+        first_within = chunks[0]
+    else:
+        first_within = GeoDataFrame(
+            concat(chunks, ignore_index=True),
+            geometry=chunks[0].geometry.name, crs=chunks[0].crs)
+
+    outputDataObject = GaiaDataObject(
+        reader=None, dataFormat=gaia.formats.PANDAS, epsg=first.get_epsg())
+    outputDataObject.set_data(first_within)
+    outputDataObject._datatype = gaia.types.VECTOR
+
+    # Construct bounds, which uses geojson format
+    xmin, ymin, xmax, ymax = first_within.geometry.total_bounds
+    coords = [[
+        [xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]
+    ]]
+    metadata = {
+        'bounds': {
+            'coordinates': coords
+        }
+    }
+    outputDataObject.set_metadata(metadata)
+    return outputDataObject
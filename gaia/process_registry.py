@@ -4,6 +4,8 @@ from builtins import (
 )
 
 from gaia import GaiaException
+from gaia.cache import get_result_cache
+from gaia.gaia_data import GaiaDataObject
 
 
 """
@@ -19,6 +21,14 @@ available to the whole application.
 """
 __process_registry = {}
 
+"""
+The input types each process declared when registering, and the processes
+matching the input types of each process name and input signature seen so
+far, so that compute only has to match input types once per signature.
+"""
+__process_inputs = {}
+__dispatch_cache = {}
+
 
 def find_processes(processName):
     """
@@ -29,18 +39,69 @@ def find_processes(processName):
     return None
 
 
-def register_process(processName):
+def register_process(processName, inputs=None):
     """
     Return a process registration decorator
+
+    :param processName: name of the process
+    :param inputs: list of (data object class, datatype) pairs the inputs
+    of the process must match, one per input, a datatype of None matching
+    any datatype.  A process registered without inputs is tried for any
+    inputs.
     """
     def processRegistrationDecorator(computeMethod):
         if processName not in __process_registry:
             __process_registry[processName] = []
         __process_registry[processName].append(computeMethod)
+        __process_inputs[computeMethod] = inputs
+        __dispatch_cache.clear()
         return computeMethod
     return processRegistrationDecorator
 
 
+def input_signature(inputs):
+    """
+    Return the (data object class, datatype) pair of each input, which
+    dispatching processes depends on.
+    """
+    signature = []
+    for procInput in inputs:
+        datatype = None
+        if isinstance(procInput, GaiaDataObject):
+            datatype = procInput._getdatatype()
+        signature.append((type(procInput), datatype))
+    return tuple(signature)
+
+
+def dispatch(processName, inputs):
+    """
+    Return the processes registered for a process name whose declared
+    input types match the inputs, in registration order.  The match is
+    computed once per input signature.
+    """
+    signature = input_signature(inputs)
+    key = (processName, signature)
+    if key not in __dispatch_cache:
+        __dispatch_cache[key] = [
+            p for p in find_processes(processName) or []
+            if _matches(__process_inputs.get(p), signature)]
+    return __dispatch_cache[key]
+
+
+def _matches(processInputs, signature):
+    if processInputs is None:
+        return True
+    if len(processInputs) != len(signature):
+        return False
+    for (inputClass, inputType), (cls, datatype) in zip(
+            processInputs, signature):
+        if not issubclass(cls, inputClass):
+            return False
+        if inputType is not None and datatype != inputType:
+            return False
+    return True
+
+
 def list_processes(processName=None):
     """
     Display a list of the processes in the registry, for debugging or
@@ -64,6 +125,13 @@ def list_processes(processName=None):
 def compute(processName, inputs, args):
     """
     Just looks up a process that can do the job and asks it to 'compute'
+
+    Only the processes whose declared input types match the inputs are
+    tried, so that validators of processes for other data types never run.
+
+    When the result cache is enabled, a result previously computed by the
+    same process from unchanged inputs and equal arguments is read back
+    from the cache instead.
     """
     processes = find_processes(processName)
 
@@ -71,12 +139,24 @@ def compute(processName, inputs, args):
         list_processes(processName)
         raise GaiaException('Unable to find suitable %s process' % processName)
 
-    for p in processes:
+    cache = get_result_cache()
+    key = cache.key(processName, inputs, args) if cache else None
+    if key:
+        result = cache.get(key)
+        if result is not None:
+            result._fingerprint = key
+            return result
+
+    for p in dispatch(processName, inputs):
         # How will we choose between equally "valid" processes?  For now
         # just return the first one.
         try:
-            return p(inputs, args)
+            result = p(inputs, args)
         except GaiaException:
-            pass
+            continue
+        if key:
+            cache.put(key, result)
+            result._fingerprint = key
+        return result
 
     raise GaiaException('No registered processes were able to validate inputs')
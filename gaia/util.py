@@ -3,7 +3,195 @@ from builtins import (
     bytes, str, open, super, range, zip, round, input, int, pow, object
 )
 
-sqlengines = {}
+import os
+import threading
+import time
+
+
+class SqlEngineRegistry(object):
+    """
+    Process-wide registry of SQLAlchemy engines, keyed by connection string.
+
+    Engines are created on first use with the pool settings of the
+    [gaia_postgis] configuration section (pool_size, max_overflow,
+    pool_timeout, pool_recycle and pool_pre_ping, which checks connections
+    are alive before handing them out).  After a fork the child drops the
+    pools inherited from its parent without closing their connections, so
+    the two processes never share a socket.  The registry can be used like
+    the dict it replaces.
+    """
+    #: Pool settings read from the configuration, with their types
+    pool_settings = {
+        'pool_size': int,
+        'max_overflow': int,
+        'pool_timeout': float,
+        'pool_recycle': int,
+        'pool_pre_ping': lambda v: str(v).lower() in ('1', 'true', 'yes'),
+    }
+
+    def __init__(self):
+        self._engines = {}
+        self._stats = {}
+        self._inherited_pools = []
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def get_engine(self, connection_string, **options):
+        """
+        Return the engine of a connection string, creating it if needed.
+
+        :param connection_string: SQLAlchemy database URL
+        :param options: create_engine options overriding the configuration
+        :return: SQLAlchemy Engine object
+        """
+        with self._lock:
+            self._check_pid()
+            if connection_string not in self._engines:
+                self._engines[connection_string] = self._create_engine(
+                    connection_string, **options)
+            return self._engines[connection_string]
+
+    def dispose(self, connection_string=None):
+        """
+        Close the pooled connections of one or all of the engines, and
+        forget them.
+
+        :param connection_string: SQLAlchemy database URL, None for all
+        """
+        with self._lock:
+            if connection_string is None:
+                keys = list(self._engines)
+            else:
+                keys = [connection_string]
+            for key in keys:
+                engine = self._engines.pop(key, None)
+                self._stats.pop(key, None)
+                if engine is not None:
+                    engine.dispose()
+
+    def stats(self):
+        """
+        Return the pool statistics of each engine: connections checked out
+        and idle in the pool, overflow, number of checkouts and the total
+        time in seconds spent waiting for a free connection (not opening one).
+
+        :return: dict of statistics dicts, keyed by database URL (with the
+        password hidden)
+        """
+        result = {}
+        with self._lock:
+            for key, engine in self._engines.items():
+                pool = engine.pool
+                stats = dict(self._stats[key])
+                for name, method in (('pool_size', 'size'),
+                                     ('checked_out', 'checkedout'),
+                                     ('idle', 'checkedin'),
+                                     ('overflow', 'overflow')):
+                    if hasattr(pool, method):
+                        stats[name] = getattr(pool, method)()
+                result[repr(engine.url)] = stats
+        return result
+
+    def _create_engine(self, connection_string, **options):
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.pool import QueuePool
+
+        stats = {'checkouts': 0, 'wait_time': 0.0}
+        self._stats[connection_string] = stats
+        registry = self
+        local = threading.local()
+
+        class TimedQueuePool(QueuePool):
+            # Accumulate the time spent waiting for a free connection,
+            # without the time spent opening new connections
+            def _do_get(self):
+                local.connect_time = 0.0
+                start = time.time()
+                try:
+                    return super(TimedQueuePool, self)._do_get()
+                finally:
+                    wait = time.time() - start - local.connect_time
+                    with registry._lock:
+                        stats['wait_time'] += max(wait, 0.0)
+
+            def _create_connection(self):
+                start = time.time()
+                try:
+                    return super(TimedQueuePool, self)._create_connection()
+                finally:
+                    local.connect_time = (getattr(local, 'connect_time', 0.0) +
+                                          time.time() - start)
+
+        kwargs = self._get_pool_options()
+        kwargs['poolclass'] = TimedQueuePool
+        kwargs.update(options)
+        engine = create_engine(connection_string, **kwargs)
+
+        @event.listens_for(engine, 'checkout')
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            with registry._lock:
+                stats['checkouts'] += 1
+
+        return engine
+
+    def _get_pool_options(self):
+        import gaia
+        settings = gaia.get_config().get('gaia_postgis', {})
+        options = {}
+        for key, convert in self.pool_settings.items():
+            if settings.get(key) not in (None, ''):
+                options[key] = convert(settings[key])
+        return options
+
+    def _check_pid(self):
+        # Fallback for Pythons without os.register_at_fork
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _after_fork(self):
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        for engine in self._engines.values():
+            # Give the child fresh pools.  The inherited ones are kept
+            # referenced so that their connections, which belong to the
+            # parent, are never closed by garbage collection in the child
+            self._inherited_pools.append(engine.pool)
+            engine.pool = engine.pool.recreate()
+
+    # Dict-like access, as sqlengines used to be a plain dict
+    def __getitem__(self, connection_string):
+        with self._lock:
+            self._check_pid()
+            return self._engines[connection_string]
+
+    def __setitem__(self, connection_string, engine):
+        with self._lock:
+            self._engines[connection_string] = engine
+            self._stats.setdefault(
+                connection_string, {'checkouts': 0, 'wait_time': 0.0})
+
+    def __delitem__(self, connection_string):
+        self.dispose(connection_string)
+
+    def __contains__(self, connection_string):
+        return connection_string in self._engines
+
+    def __iter__(self):
+        return iter(list(self._engines))
+
+    def __len__(self):
+        return len(self._engines)
+
+    def get(self, connection_string, default=None):
+        with self._lock:
+            self._check_pid()
+            return self._engines.get(connection_string, default)
+
+
+#: Registry of SQLAlchemy engines, shared by all PostGIS data objects
+sqlengines = SqlEngineRegistry()
 
 
 class GaiaException(Exception):
@@ -18,9 +18,14 @@
 ###############################################################################
 import os
 import json
+import shutil
+import tempfile
 import unittest
 from zipfile import ZipFile
+import geopandas
 import gaia
+import gaia.cache
+import gaia.types
 from gaia.preprocess import crop
 
 base_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)))
@@ -47,3 +52,200 @@ class TestCreateAPI(unittest.TestCase):
         output = crop(data1, data2)
 
         self.assertEqual(len(output.get_data()), 19)
+
+    def test_vector_metadata(self):
+        """
+        Test that vector metadata is read without loading the features
+        """
+        path = os.path.join(testfile_path, 'baghdad_districts.geojson')
+        data = gaia.create(path)
+
+        bounds = data.get_metadata()['bounds']['coordinates'][0]
+        self.assertIsNone(data._data)
+        self.assertEqual(data.get_epsg(), 4326)
+
+        total_bounds = data.get_data().total_bounds
+        self.assertAlmostEqual(bounds[0][0], total_bounds[0])
+        self.assertAlmostEqual(bounds[2][1], total_bounds[3])
+
+    def test_declared_types(self):
+        """
+        Test that datatype, container and EPSG code are known before loading
+        """
+        vector = gaia.create(
+            os.path.join(testfile_path, 'baghdad_districts.geojson'))
+        self.assertEqual(vector.datatype, gaia.types.VECTOR)
+        self.assertIs(vector.get_container(), geopandas.GeoDataFrame)
+        self.assertEqual(vector.get_epsg(), 4326)
+        self.assertIsNone(vector._data)
+
+        raster = gaia.create(os.path.join(testfile_path, 'simplergb.tif'))
+        self.assertEqual(raster.datatype, gaia.types.RASTER)
+        self.assertIsNone(raster._metadata)
+        self.assertIsNone(raster._data)
+
+    def test_raster_metadata(self):
+        """
+        Test that raster metadata is read from the header only
+        """
+        path = os.path.join(testfile_path, 'simplergb.tif')
+        data = gaia.create(path)
+
+        metadata = data.get_metadata()
+        self.assertIsNone(data._data)
+        self.assertEqual(metadata['band_count'], 3)
+        self.assertEqual(len(metadata['dtypes']), 3)
+        self.assertEqual(data.datatype, 'raster')
+
+        dataset = data.get_data()
+        self.assertEqual(metadata['width'], dataset.RasterXSize)
+        self.assertEqual(metadata['height'], dataset.RasterYSize)
+
+    def test_iter_chunks(self):
+        """
+        Test iterating over vector and raster data in chunks
+        """
+        path = os.path.join(testfile_path, 'iraq_hospitals.geojson')
+        vector = gaia.create(path)
+        chunks = list(vector.iter_chunks(chunk_size=50))
+        self.assertTrue(all(len(chunk) <= 50 for chunk in chunks))
+        self.assertEqual(sum(len(chunk) for chunk in chunks),
+                         len(vector.get_data()))
+
+        bbox = (44.0, 33.0, 45.0, 34.0)
+        streamed = gaia.create(path, chunk_size=50)
+        in_bbox = sum(len(c) for c in streamed.iter_chunks(bbox=bbox))
+        self.assertIsNone(streamed._data)
+        self.assertEqual(in_bbox,
+                         sum(len(c) for c in vector.iter_chunks(bbox=bbox)))
+
+        raster = gaia.create(os.path.join(testfile_path, 'simplergb.tif'))
+        pixels = 0
+        for (xoff, yoff, xsize, ysize), array in raster.iter_chunks():
+            self.assertEqual(array.shape, (3, ysize, xsize))
+            pixels += xsize * ysize
+        dataset = raster.get_data()
+        self.assertEqual(pixels, dataset.RasterXSize * dataset.RasterYSize)
+
+    def test_save_cog(self):
+        """
+        Test writing a raster as a Cloud-Optimized GeoTIFF
+        """
+        raster = gaia.create(os.path.join(testfile_path, 'globalairtemp.tif'))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'globalairtemp_cog.tif')
+            gaia.save(raster, filename, cog=True, blocksize=128)
+            cog = gaia.create(filename)
+            metadata = cog.get_metadata()
+            self.assertEqual(metadata['width'], raster.get_data().RasterXSize)
+            self.assertTrue(metadata['overviews'])
+            block_size = cog.get_data().GetRasterBand(1).GetBlockSize()
+            self.assertEqual(block_size, [128, 128])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_geoparquet(self):
+        """
+        Test saving and reading vector data as GeoParquet and Feather
+        """
+        data = gaia.create(
+            os.path.join(testfile_path, 'iraq_hospitals.geojson'))
+        df = data.get_data()
+        bbox = (44.0, 33.0, 45.0, 34.0)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for ext in ('.parquet', '.feather'):
+                filename = os.path.join(tmpdir, 'iraq_hospitals' + ext)
+                gaia.save(data, filename)
+                copy = gaia.create(filename)
+                self.assertEqual(copy.get_epsg(), 4326)
+                self.assertEqual(len(copy.get_data()), len(df))
+
+                subset = gaia.create(filename, columns=[df.columns[0]],
+                                     bbox=bbox).get_data()
+                self.assertEqual(len(subset.columns), 2)
+                self.assertEqual(len(subset), len(df.cx[44:45, 33:34]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_result_cache(self):
+        """
+        Test that crop and reproject results are read back from the cache
+        """
+        path1 = os.path.join(testfile_path, 'iraq_hospitals.geojson')
+        path2 = os.path.join(testfile_path, 'baghdad_districts.geojson')
+        cache_dir = tempfile.mkdtemp()
+        settings = gaia.get_config()['gaia']
+        settings['cache_dir'] = cache_dir
+        try:
+            output = crop(gaia.create(path1), gaia.create(path2))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            cached = crop(gaia.create(path1), gaia.create(path2))
+            self.assertTrue(cached._reader.uri.startswith(cache_dir))
+            self.assertEqual(cached._fingerprint, output._fingerprint)
+            self.assertEqual(len(cached.get_data()), 19)
+
+            data = gaia.create(path2)
+            data.reproject(3857)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            data = gaia.create(path2)
+            data.reproject(3857)
+            self.assertEqual(data.get_epsg(), 3857)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        finally:
+            settings['cache_dir'] = ''
+            shutil.rmtree(cache_dir)
+
+    def test_result_cache_evict(self):
+        """
+        Test that eviction removes the least recently used entries and
+        leaves the temporary files of results being stored
+        """
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = gaia.cache.ResultCache(cache_dir, 25)
+            names = ['old.parquet', 'new.tif', 'key.123.tmp.parquet']
+            for mtime, name in enumerate(names):
+                path = os.path.join(cache_dir, name)
+                with open(path, 'wb') as f:
+                    f.write(b'x' * 20)
+                os.utime(path, (mtime, mtime))
+
+            cache.evict()
+            self.assertEqual(sorted(os.listdir(cache_dir)),
+                             ['key.123.tmp.parquet', 'new.tif'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_result_cache_dirty(self):
+        """
+        Test that data replaced since it was read is not identified by the
+        fingerprint of its file
+        """
+        path1 = os.path.join(testfile_path, 'iraq_hospitals.geojson')
+        path2 = os.path.join(testfile_path, 'baghdad_districts.geojson')
+        data = gaia.create(path2)
+        data.get_data()
+        self.assertIsNotNone(gaia.cache.fingerprint(data))
+        data.reproject(3857)
+        self.assertIsNone(gaia.cache.fingerprint(data))
+
+        cache_dir = tempfile.mkdtemp()
+        settings = gaia.get_config()['gaia']
+        settings['cache_dir'] = cache_dir
+        try:
+            subset = gaia.create(path1)
+            subset.set_data(subset.get_data().iloc[:5])
+            self.assertIsNone(gaia.cache.fingerprint(subset))
+            output = crop(subset, gaia.create(path2))
+            self.assertLessEqual(len(output.get_data()), 5)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+            output = crop(gaia.create(path1), gaia.create(path2))
+            self.assertEqual(len(output.get_data()), 19)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            settings['cache_dir'] = ''
+            shutil.rmtree(cache_dir)
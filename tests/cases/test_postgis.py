@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc. and Epidemico Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import geopandas
+import pandas
+from shapely import wkb
+from shapely.geometry import Point, box
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import gaia.gaia_data
+import gaia.types
+from gaia.filters import filter_postgis, geometry_hex, postgis_geometry
+from gaia.gaia_data import GaiaDataObject, PostgisDataObject
+from gaia.io.postgis_reader import GaiaPostGISReader
+from gaia.io.postgis_writer import (
+    COPY_HEADER, COPY_TRAILER, _column_type, _copy_data)
+from gaia.preprocess.postgis_processes import crop_postgis
+from gaia.util import SqlEngineRegistry
+
+
+class FakeCursor(object):
+    """
+    Named psycopg2 cursor returning a fixed list of rows
+    """
+    def __init__(self, connection, name, rows, description):
+        self.connection = connection
+        self.name = name
+        self.rows = rows
+        self.description = description
+        self.itersize = None
+        self.executed = None
+
+    def execute(self, query, params=None):
+        self.executed = (query, params)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, rows, description):
+        self.rows = rows
+        self.description = description
+        self.cursors = []
+        self.closed = False
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self, name, self.rows, self.description)
+        self.cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        self.closed = True
+
+
+def postgis_object(connection, **options):
+    """
+    Create a PostgisDataObject of a (id, geom) table read through a fake
+    connection, without reflecting the table
+    """
+    reader = GaiaPostGISReader(table='points', dbname='db', hostname='host',
+                               user='user', password='pass', **options)
+    data = reader.read()
+    data._columns = ['id', 'geom']
+    data._geom_column = 'geom'
+    data._epsg = 4326
+    data.engine = mock.Mock(raw_connection=lambda: connection)
+    return data
+
+
+class TestPostgis(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(PostgisDataObject, 'initialize_engine')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_iter_chunks(self):
+        """
+        Test that rows are fetched through a named cursor in batches and
+        that their WKB geometries are decoded
+        """
+        rows = [(i, memoryview(Point(i, -i).wkb)) for i in range(5)]
+        rows.append((5, None))
+        connection = FakeConnection(rows, [('id',), ('geom',)])
+        data = postgis_object(connection, itersize=3)
+
+        chunks = list(data.iter_chunks(chunk_size=4))
+
+        cursor = connection.cursors[0]
+        self.assertTrue(cursor.name.startswith('gaia_'))
+        self.assertEqual(cursor.itersize, 3)
+        self.assertIn('ST_AsBinary("geom") AS "geom"', cursor.executed[0])
+        self.assertFalse(cursor.executed[0].endswith(';'))
+        self.assertTrue(connection.closed)
+
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+        self.assertEqual(chunks[0].geometry.name, 'geom')
+        self.assertEqual(chunks[0].crs.to_epsg(), 4326)
+        self.assertEqual(list(chunks[1]['id']), [4, 5])
+        self.assertTrue(chunks[0].geometry.iloc[2].equals(Point(2, -2)))
+        self.assertIsNone(chunks[1].geometry.iloc[1])
+
+    def test_load_data(self):
+        """
+        Test that tables are streamed by writers until they are loaded,
+        and that get_data() loads every chunk
+        """
+        rows = [(i, memoryview(Point(i, i).wkb)) for i in range(5)]
+        connection = FakeConnection(rows, [('id',), ('geom',)])
+
+        data = postgis_object(connection, itersize=2)
+        self.assertEqual(data.get_chunk_size(), 2)
+        self.assertEqual(list(data.get_data()['id']), list(range(5)))
+        self.assertEqual(data.get_data().crs.to_epsg(), 4326)
+        self.assertIsNone(data.get_chunk_size())
+
+    def test_crop_query(self):
+        """
+        Test that a crop adds its geometry as a filter in the projection
+        of the filters the table already has
+        """
+        connection = FakeConnection([], [('id',), ('geom',)])
+        data = postgis_object(connection)
+        data._epsg = 3857
+        data.filter_epsg = 4326
+        data.spatial_filters = [('geom', 'intersects', box(44, 33, 45, 34))]
+
+        # A clip geometry in UTM zone 38N
+        clip = GaiaDataObject(epsg=32638)
+        clip.set_data(geopandas.GeoDataFrame(
+            geometry=[box(400000, 3600000, 500000, 3700000)],
+            crs='EPSG:32638'))
+        clip._datatype = gaia.types.VECTOR
+
+        output = crop_postgis([data, clip], {'predicate': 'within'})
+
+        query, params = connection.cursors[0].executed
+        geometry = ("ST_Transform(ST_GeomFromWKB(decode(%s, 'hex'), 4326), "
+                    "3857)")
+        self.assertIn('ST_Intersects("geom", {})'.format(geometry), query)
+        self.assertIn('ST_Within("geom", {})'.format(geometry), query)
+        self.assertNotIn('32638', query)
+        self.assertEqual(len(params), 2)
+        self.assertTrue(wkb.loads(params[0], hex=True).equals(
+            box(44, 33, 45, 34)))
+        expected = clip.get_unary_union(epsg=4326)
+        self.assertTrue(wkb.loads(params[1], hex=True).equals_exact(
+            expected, 1e-9))
+        self.assertEqual(output.get_epsg(), 3857)
+        self.assertEqual(len(output.get_data()), 0)
+        self.assertEqual(data.spatial_filters,
+                         [('geom', 'intersects', box(44, 33, 45, 34))])
+
+
+class TestPostgisFilters(unittest.TestCase):
+
+    def test_postgis_geometry(self):
+        """
+        Test the SQL expressions of filter geometries
+        """
+        wkb_sql = "ST_GeomFromWKB(decode(%s, 'hex'){})"
+        self.assertEqual(postgis_geometry(), wkb_sql.format(''))
+        self.assertEqual(postgis_geometry(4326), wkb_sql.format(', 4326'))
+        self.assertEqual(postgis_geometry(4326, 4326),
+                         wkb_sql.format(', 4326'))
+        self.assertEqual(postgis_geometry(3857, 4326),
+                         'ST_Transform({}, 3857)'.format(
+                             wkb_sql.format(', 4326')))
+        self.assertEqual(postgis_geometry(None, 4326, envelope=True),
+                         'ST_MakeEnvelope(%s, %s, %s, %s, 4326)')
+
+    def test_geometry_hex(self):
+        """
+        Test encoding shapely and GeoJSON geometries as hex WKB
+        """
+        point = Point(1, 2)
+        self.assertEqual(geometry_hex(point), point.wkb_hex)
+        self.assertEqual(
+            geometry_hex({'type': 'Point', 'coordinates': [1, 2]}),
+            point.wkb_hex)
+
+    def test_spatial_filters(self):
+        """
+        Test the SQL and parameters of each spatial operator
+        """
+        polygon = box(0, 0, 1, 1)
+        geometry = "ST_GeomFromWKB(decode(%s, 'hex'), 4326)"
+
+        for operator, template in [
+                ('within', 'ST_Within("geom", {})'),
+                ('intersects', 'ST_Intersects("geom", {})')]:
+            sql, params = filter_postgis([('geom', operator, polygon)],
+                                         srid=4326)
+            self.assertEqual(sql, template.format(geometry))
+            self.assertEqual(params, [polygon.wkb_hex])
+
+        sql, params = filter_postgis([('geom', 'dwithin', (polygon, 5))],
+                                     srid=4326)
+        self.assertEqual(sql, 'ST_DWithin("geom", {}, %s)'.format(geometry))
+        self.assertEqual(params, [polygon.wkb_hex, 5])
+
+        sql, params = filter_postgis([(None, '&&', (0, 0, 1, 1))],
+                                     srid=3857, epsg=4326, geom_column='g')
+        self.assertEqual(
+            sql, '"g" && ST_Transform('
+                 'ST_MakeEnvelope(%s, %s, %s, %s, 4326), 3857)')
+        self.assertEqual(params, [0, 0, 1, 1])
+
+        sql, params = filter_postgis([('geom', '&&', polygon)], srid=4326)
+        self.assertEqual(sql, '"geom" && {}'.format(geometry))
+        self.assertEqual(params, [polygon.wkb_hex])
+
+    def test_spatial_filter_sequences(self):
+        """
+        Test that only '&&' takes four values as a bounding box
+        """
+        for operator in ('within', 'intersects'):
+            self.assertRaises(Exception, filter_postgis,
+                              [('geom', operator, (0, 0, 1, 1))], srid=4326)
+
+        line = {'type': 'LineString',
+                'coordinates': [[0, 0], [1, 1], [2, 2], [3, 3]]}
+        sql, params = filter_postgis([('geom', 'dwithin', (line, 10))])
+        self.assertNotIn('ST_MakeEnvelope', sql)
+        self.assertEqual(params, [geometry_hex(line), 10])
+
+    def test_attribute_filters(self):
+        """
+        Test attribute filters mixed with spatial ones and joiners
+        """
+        sql, params = filter_postgis([
+            ('id', 'in', [1, 2]),
+            ('name', '=', 'a', ' OR '),
+            ('geom', 'intersects', Point(1, 2))])
+        self.assertEqual(
+            sql, '"id" in (%s,%s) OR "name" = %s OR '
+                 'ST_Intersects("geom", ST_GeomFromWKB(decode(%s, \'hex\')))')
+        self.assertEqual(params, [1, 2, 'a', Point(1, 2).wkb_hex])
+
+
+class TestSqlEngineRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.registry = SqlEngineRegistry()
+        self.addCleanup(self.registry.dispose)
+
+    def url(self, name):
+        return 'sqlite:///' + os.path.join(self.tmpdir, name)
+
+    def test_engine_reuse(self):
+        """
+        Test that engines are created once per URL and disposed of
+        """
+        engine = self.registry.get_engine(self.url('a.db'))
+        self.assertIs(self.registry.get_engine(self.url('a.db')), engine)
+        self.assertIsNot(self.registry.get_engine(self.url('b.db')), engine)
+        self.assertEqual(len(self.registry), 2)
+
+        self.registry.dispose(self.url('a.db'))
+        self.assertNotIn(self.url('a.db'), self.registry)
+        self.assertIn(self.url('b.db'), self.registry)
+        self.assertIsNot(self.registry.get_engine(self.url('a.db')), engine)
+
+    def test_after_fork(self):
+        """
+        Test that a forked child gets fresh pools and keeps the inherited
+        ones referenced
+        """
+        engine = self.registry.get_engine(self.url('a.db'))
+        with engine.connect():
+            pass
+        pool = engine.pool
+
+        self.registry._after_fork()
+
+        self.assertIsNot(engine.pool, pool)
+        self.assertIs(type(engine.pool), type(pool))
+        self.assertIn(pool, self.registry._inherited_pools)
+        self.assertIs(self.registry.get_engine(self.url('a.db')), engine)
+        with engine.connect():
+            pass
+        stats = self.registry.stats()[repr(engine.url)]
+        self.assertEqual(stats['checkouts'], 2)
+
+    def test_wait_time(self):
+        """
+        Test that the pool statistics count the time waiting for a free
+        connection, but not the time opening one
+        """
+        path = os.path.join(self.tmpdir, 'a.db')
+
+        def slow_connect():
+            time.sleep(0.3)
+            return sqlite3.connect(path, check_same_thread=False)
+
+        engine = self.registry.get_engine(
+            self.url('a.db'), creator=slow_connect, pool_size=1,
+            max_overflow=0)
+        connection = engine.connect()
+        stats = self.registry.stats()[repr(engine.url)]
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertLess(stats['wait_time'], 0.2)
+
+        def checkout():
+            with engine.connect():
+                pass
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        time.sleep(0.5)
+        connection.close()
+        thread.join()
+
+        stats = self.registry.stats()[repr(engine.url)]
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertGreaterEqual(stats['wait_time'], 0.4)
+        self.assertEqual(stats['checked_out'], 0)
+
+
+class TestTableInfoCache(unittest.TestCase):
+
+    def setUp(self):
+        gaia.gaia_data.clear_table_info_cache()
+        self.addCleanup(gaia.gaia_data.clear_table_info_cache)
+        self.now = 1000.0
+        self.reflections = 0
+        self.blocked = {}
+        for target, value in [
+                ('time', mock.Mock(time=lambda: self.now)),
+                ('_table_info_ttl', lambda: 300)]:
+            patcher = mock.patch.object(gaia.gaia_data, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(PostgisDataObject, '_reflect_table',
+                                    autospec=True, side_effect=self.reflect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reflect(self, data):
+        self.reflections += 1
+        if data.table in self.blocked:
+            started, release = self.blocked[data.table]
+            started.set()
+            release.wait(10)
+        return {
+            'time': self.now,
+            'columns': ['id', 'geom'],
+            'geom_column': 'geom',
+            'geometry_type': 'POINT',
+            'epsg': 4326,
+            'table_obj': None,
+            'meta': None,
+        }
+
+    def table(self, name='points', url='postgresql://host/db'):
+        data = PostgisDataObject()
+        data.table = name
+        data.engine = mock.Mock(url=url)
+        data.get_table_info()
+        return data
+
+    def test_cache_hits(self):
+        """
+        Test that tables are reflected once per database and table
+        """
+        first = self.table()
+        second = self.table()
+        self.assertEqual(self.reflections, 1)
+        self.assertEqual(second.get_epsg(), 4326)
+        self.assertEqual(second.geom_column, 'geom')
+        self.assertEqual(second._columns, ['id', 'geom'])
+        # Objects get their own column lists
+        self.assertIsNot(first._columns, second._columns)
+
+        self.table(name='lines')
+        self.table(url='postgresql://other/db')
+        self.assertEqual(self.reflections, 3)
+
+    def test_ttl(self):
+        """
+        Test that table information is reflected again once expired
+        """
+        self.table()
+        self.now += 299
+        self.table()
+        self.assertEqual(self.reflections, 1)
+        self.now += 2
+        self.table()
+        self.assertEqual(self.reflections, 2)
+        self.now += 100
+        self.table()
+        self.assertEqual(self.reflections, 2)
+
+        gaia.gaia_data.clear_table_info_cache()
+        self.table()
+        self.assertEqual(self.reflections, 3)
+
+    def test_concurrent_reflection(self):
+        """
+        Test that reflecting a table does not hold up other tables
+        """
+        started, release = threading.Event(), threading.Event()
+        self.blocked['points'] = (started, release)
+        thread = threading.Thread(target=self.table)
+        thread.start()
+        try:
+            self.assertTrue(started.wait(10))
+            self.assertEqual(self.table(name='lines').get_epsg(), 4326)
+            self.assertFalse(release.is_set())
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(self.reflections, 2)
+        self.table()
+        self.assertEqual(self.reflections, 2)
+
+
+class TestPostgisCopy(unittest.TestCase):
+
+    def test_copy_data(self):
+        """
+        Test the binary COPY encoding of rows, nulls and EWKB geometries
+        """
+        rows = geopandas.GeoDataFrame({
+            'i': [1, -2],
+            'f': [1.5, float('nan')],
+            't': [u'caf\xe9', None],
+            'n': pandas.array([pandas.NA, 7], dtype='Int64'),
+        }, geometry=[Point(1, 2), None])
+        data = _copy_data(rows, ['i', 'f', 't', 'n'], 'geometry', 4326)
+        data = data.read()
+
+        self.assertTrue(data.startswith(b'PGCOPY\n\xff\r\n\x00'))
+        self.assertEqual(data[:19], COPY_HEADER)
+        self.assertEqual(data[-2:], COPY_TRAILER)
+        self.assertEqual(COPY_TRAILER, b'\xff\xff')
+
+        null = struct.pack('>i', -1)
+        ewkb = (b'\x01' + struct.pack('<I', 0x20000001) +
+                struct.pack('<I', 4326) + struct.pack('<dd', 1, 2))
+        first = (struct.pack('>h', 5) +
+                 struct.pack('>i', 8) + struct.pack('>q', 1) +
+                 struct.pack('>i', 8) + struct.pack('>d', 1.5) +
+                 struct.pack('>i', 5) + u'caf\xe9'.encode('utf-8') +
+                 null +
+                 struct.pack('>i', len(ewkb)) + ewkb)
+        second = (struct.pack('>h', 5) +
+                  struct.pack('>i', 8) + struct.pack('>q', -2) +
+                  null + null +
+                  struct.pack('>i', 8) + struct.pack('>q', 7) +
+                  null)
+        self.assertEqual(data[19:-2], first + second)
+
+    def test_copy_data_without_srid(self):
+        """
+        Test that geometries are sent as plain WKB without a SRID
+        """
+        rows = geopandas.GeoDataFrame(geometry=[Point(3, 4)])
+        data = _copy_data(rows, [], 'geometry', None).read()
+        wkb = Point(3, 4).wkb
+        self.assertEqual(data[19:-2], struct.pack('>h', 1) +
+                         struct.pack('>i', len(wkb)) + wkb)
+
+    def test_timestamps(self):
+        """
+        Test that time zone aware timestamps are created as timestamptz
+        columns and sent as UTC instants
+        """
+        rows = geopandas.GeoDataFrame({
+            'naive': pandas.to_datetime(['2000-01-01 01:00']),
+            'aware': pandas.to_datetime(['2000-01-01 01:00']).tz_localize(
+                'Europe/Paris'),
+        }, geometry=[Point(0, 0)])
+        self.assertEqual(_column_type(rows['naive'].dtype), 'timestamp')
+        self.assertEqual(_column_type(rows['aware'].dtype), 'timestamptz')
+        self.assertEqual(_column_type(rows['geometry'].dtype), 'text')
+
+        data = _copy_data(rows, ['naive', 'aware'], 'geometry', None).read()
+        hour = 3600 * 10 ** 6
+        self.assertEqual(data[21:45], struct.pack('>i', 8) +
+                         struct.pack('>q', hour) + struct.pack('>i', 8) +
+                         struct.pack('>q', 0))
@@ -18,19 +18,76 @@
 ###############################################################################
 import os
 import json
+import shutil
+import tempfile
 import unittest
 from zipfile import ZipFile
 
 import geojson
+import numpy
 
 import gaia
 from gaia.preprocess import crop
+from gaia.preprocess.gdal_processes import compute_subset_gdal
+from gaia.preprocess.pandas_processes import crop_pandas
+from gaia.process_registry import dispatch
 from gaia.io import readers
 
 base_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)))
 testfile_path = os.path.join(base_dir, '../data')
 
 
+def mem_raster(array, geotransform=(0, 1, 0, 0, 0, -1), epsg=4326,
+               nodata=None):
+    """
+    Create an in-memory single-band GDAL raster from a 2D numpy array
+    """
+    try:
+        import gdalnumeric
+    except ImportError:
+        from osgeo import gdalnumeric
+    import osr
+    dataset = gdalnumeric.OpenArray(array)
+    dataset.SetGeoTransform(geotransform)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    dataset.SetProjection(srs.ExportToWkt())
+    if nodata is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(nodata)
+    return dataset
+
+
+def zone_rectangles(windows, geotransform):
+    """
+    Create a GeoJSON collection of rectangular zones covering the pixels
+    of (col0, row0, col1, row1) windows, their edges a quarter pixel
+    inside the window so that exactly its pixel centers are covered
+    """
+    features = []
+    for col0, row0, col1, row1 in windows:
+        xs = [geotransform[0] + c * geotransform[1]
+              for c in (col0 + 0.25, col1 - 0.25)]
+        ys = [geotransform[3] + r * geotransform[5]
+              for r in (row0 + 0.25, row1 - 0.25)]
+        ring = [[xs[0], ys[0]], [xs[1], ys[0]], [xs[1], ys[1]],
+                [xs[0], ys[1]], [xs[0], ys[0]]]
+        features.append({
+            'type': 'Feature', 'properties': {},
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def window_values(array, window, nodata=None):
+    """
+    Return the valid values of a (col0, row0, col1, row1) array window
+    """
+    col0, row0, col1, row1 = window
+    values = array[row0:row1, col0:col1].astype('float64').ravel()
+    if nodata is not None:
+        values = values[values != nodata]
+    return values
+
+
 class TestGaiaProcesses(unittest.TestCase):
 
     @classmethod
@@ -99,3 +156,282 @@ class TestGaiaProcesses(unittest.TestCase):
 
         cropped_raster = crop(input_raster, crop_geom)
         self.assertIsNotNone(cropped_raster)
+
+    def test_crop_gdal_windowed(self):
+        """
+        Test that the windowed raster crop only covers the crop envelope
+        """
+        input_path = os.path.join(testfile_path, 'simplergb.tif')
+        input_raster = gaia.create(input_path)
+        source = input_raster.get_data()
+
+        bounds = input_raster.get_metadata().get('bounds').get('coordinates')
+        bounds = bounds[0]
+        x = (bounds[0][0] + bounds[2][0]) / 2.0
+        y = (bounds[0][1] + bounds[2][1]) / 2.0
+        dx = 0.12 * (bounds[2][0] - bounds[0][0])
+        dy = 0.16 * (bounds[2][1] - bounds[0][1])
+        poly = [[
+            [x, y], [x+dx, y+dy], [x-dx, y+dy], [x-dx, y-dy], [x+dx, y-dy]
+        ]]
+        crop_geom = gaia.create(geojson.Polygon(poly))
+
+        output = crop(input_raster, crop_geom).get_data()
+        self.assertEqual(output.RasterCount, source.RasterCount)
+        self.assertLess(output.RasterXSize, source.RasterXSize / 3)
+        self.assertLess(output.RasterYSize, source.RasterYSize / 3)
+
+    def test_crop_pandas_spatial_index(self):
+        """
+        Test that the indexed vector crop matches the exhaustive one
+        """
+        hospitals = gaia.create(
+            os.path.join(testfile_path, 'iraq_hospitals.geojson'))
+        districts = gaia.create(
+            os.path.join(testfile_path, 'baghdad_districts.geojson'))
+
+        indexed = crop(hospitals, districts).get_data()
+        exhaustive = crop(hospitals, districts,
+                          spatial_index=False).get_data()
+
+        self.assertEqual(len(indexed), 19)
+        self.assertEqual(list(indexed.index), list(exhaustive.index))
+
+    def test_crop_pandas_streaming(self):
+        """
+        Test cropping and saving a vector dataset read in chunks
+        """
+        hospitals = gaia.create(
+            os.path.join(testfile_path, 'iraq_hospitals.geojson'),
+            chunk_size=10)
+        districts = gaia.create(
+            os.path.join(testfile_path, 'baghdad_districts.geojson'))
+
+        output = crop(hospitals, districts)
+        self.assertEqual(len(output.get_data()), 19)
+        self.assertIsNone(hospitals._data)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'iraq_hospitals_copy.geojson')
+            gaia.save(hospitals, filename)
+            copy = gaia.create(filename)
+            self.assertEqual(len(copy.get_data()),
+                             sum(len(c) for c in hospitals.iter_chunks()))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertIsNone(hospitals._data)
+
+    def test_crop_union_cache(self):
+        """
+        Test that the crop geometry union is computed once per EPSG code
+        """
+        hospitals = gaia.create(
+            os.path.join(testfile_path, 'iraq_hospitals.geojson'))
+        districts = gaia.create(
+            os.path.join(testfile_path, 'baghdad_districts.geojson'))
+
+        union = districts.get_unary_union()
+        self.assertIs(districts.get_unary_union(), union)
+        self.assertIsNot(districts.get_unary_union(epsg=3857), union)
+
+        output = crop(hospitals, districts)
+        self.assertEqual(len(output.get_data()), 19)
+        self.assertIs(districts.get_unary_union(), union)
+
+        districts.set_data(districts.get_data())
+        self.assertIsNot(districts.get_unary_union(), union)
+
+    def test_calc_threads(self):
+        """
+        Test that block-parallel raster calculations are deterministic,
+        and only run when asked for
+        """
+        from gaia.geo.gdal_functions import _calc_threads, gdal_calc
+        raster = os.path.join(testfile_path, 'globalairtemp.tif')
+        self.assertEqual(_calc_threads(), 1)
+        self.assertEqual(_calc_threads(4), 4)
+
+        serial = gdal_calc('A * 2 - 1', '', [raster], threads=1)
+        threaded = gdal_calc('A * 2 - 1', '', [raster], threads=4)
+
+        self.assertEqual(serial.ReadAsArray().tolist(),
+                         threaded.ReadAsArray().tolist())
+
+    def test_calc_expressions(self):
+        """
+        Test that compiled calculations match plain numpy evaluation,
+        mixing arithmetic and comparisons
+        """
+        from gaia.geo.gdal_functions import _compile_calculation, gdal_calc
+        a = numpy.array([[0, 1, 0, 0], [3, 1, 2, 0]], dtype='int16')
+        b = numpy.array([[2, 2, 3, 4], [1, 5, 2, 0]], dtype='int16')
+        expressions = ['~((A + 1) == 2)', '(A + 1) == (B + 0)',
+                       '((A + 1) < (B - 1)) * (A + B)', '-(A + B) * 2',
+                       '(A * 2 + B) / (A + B + 1)', '~(A + B)',
+                       'numpy.logical_and((A + 1) > 1, (B * 2) > 4)']
+        for expression in expressions:
+            expected = eval(expression, {'numpy': numpy}, {'A': a, 'B': b})
+            result = _compile_calculation(expression)({'A': a, 'B': b})
+            self.assertEqual(result.dtype, expected.dtype, expression)
+            self.assertEqual(result.tolist(), expected.tolist(), expression)
+
+            output = gdal_calc(expression, '', [mem_raster(a), mem_raster(b)],
+                               output_type='Float64')
+            self.assertEqual(output.ReadAsArray().tolist(),
+                             expected.astype('float64').tolist(), expression)
+
+    def test_zonalstats_batched(self):
+        """
+        Test that zonal statistics computed for all zones in one raster
+        pass, tile by tile, match the per-feature engine and numpy
+        """
+        from gaia.geo.gdal_functions import gen_zonalstats_batched
+        from gaia.geo.gdal_functions import gdal_zonalstats
+        random = numpy.random.RandomState(0)
+        array = (random.rand(200, 120) * 100).astype('float32')
+        array[150:170, 10:40] = -9999
+        geotransform = (40.0, 0.01, 0, 35.0, 0, -0.01)
+        raster = mem_raster(array, geotransform, nodata=-9999)
+        # Zones within a tile, across tiles, partly nodata, fully nodata
+        # and outside of the raster
+        windows = [(2, 3, 9, 12), (60, 5, 110, 190), (30, 140, 50, 180),
+                   (12, 152, 28, 168), (300, 300, 310, 310)]
+        zones = json.dumps(zone_rectangles(windows, geotransform))
+
+        batched = list(gen_zonalstats_batched(
+            json.loads(zones), raster, tile_size=16))
+        feature = gdal_zonalstats(zones, raster, engine='feature')
+
+        for window, b, f in zip(windows, batched, feature):
+            b, f = b['properties'], f['properties']
+            values = window_values(array, window, nodata=-9999)
+            if window[0] >= array.shape[1]:
+                self.assertIsNone(b['count'])
+                self.assertIsNone(f['count'])
+                continue
+            self.assertEqual(b['count'], len(values))
+            self.assertEqual(f['count'], len(values))
+            if not len(values):
+                for p in ('mean', 'min', 'max', 'stddev'):
+                    self.assertIsNone(b[p])
+                    self.assertIsNone(f[p])
+                continue
+            for p, expected in [('sum', values.sum()),
+                                ('mean', values.mean()),
+                                ('min', values.min()),
+                                ('max', values.max()),
+                                ('stddev', values.std()),
+                                ('median', numpy.median(values))]:
+                self.assertIsNotNone(b[p])
+                self.assertAlmostEqual(b[p], expected, places=3)
+                self.assertAlmostEqual(b[p], f[p], places=3)
+
+    def test_zonalstats_overlapping(self):
+        """
+        Test that overlapping zones get the statistics of all their pixels
+        while the other zones are still computed in one pass
+        """
+        from gaia.geo.gdal_functions import gen_zonalstats_batched
+        random = numpy.random.RandomState(2)
+        array = (random.rand(60, 60) * 100).astype('float32')
+        geotransform = (40.0, 0.01, 0, 35.0, 0, -0.01)
+        raster = mem_raster(array, geotransform)
+        # Two overlapping zones, a zone within another one, and two zones
+        # side by side
+        windows = [(0, 0, 20, 20), (10, 10, 30, 30), (40, 0, 60, 30),
+                   (45, 5, 50, 10), (0, 40, 30, 60), (30, 40, 60, 60)]
+        zones = zone_rectangles(windows, geotransform)
+
+        batched = list(gen_zonalstats_batched(zones, raster, tile_size=16))
+
+        for window, feature in zip(windows, batched):
+            values = window_values(array, window)
+            properties = feature['properties']
+            self.assertEqual(properties['count'], len(values))
+            self.assertAlmostEqual(properties['mean'], values.mean(),
+                                   places=3)
+            self.assertAlmostEqual(properties['median'],
+                                   numpy.median(values), places=3)
+
+    def test_zonalstats_processes(self):
+        """
+        Test that zonal statistics computed by worker processes, for zones
+        spanning several tiles, come back in input order with the values
+        numpy computes from the same pixels
+        """
+        import gdal
+        from gaia.geo.gdal_functions import gdal_zonalstats
+        random = numpy.random.RandomState(1)
+        array = (random.rand(2600, 64) * 50).astype('float32')
+        geotransform = (0.0, 0.01, 0, 26.0, 0, -0.01)
+        # Tiles of the batched engine are about 1024 rows high
+        windows = [(0, 0, 10, 10), (5, 900, 28, 1200), (30, 1000, 64, 2100),
+                   (2, 2000, 20, 2600), (40, 100, 60, 900), (10, 20, 20, 30)]
+        zones = json.dumps(zone_rectangles(windows, geotransform))
+
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'zones.tif')
+        try:
+            gdal.GetDriverByName('GTiff').CreateCopy(
+                path, mem_raster(array, geotransform))
+            serial = gdal_zonalstats(zones, path)
+            parallel = gdal_zonalstats(zones, path, processes=2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(serial, parallel)
+        for window, feature in zip(windows, parallel):
+            properties = feature['properties']
+            values = window_values(array, window)
+            self.assertEqual(properties['count'], len(values))
+            self.assertAlmostEqual(properties['mean'], values.mean(),
+                                   places=4)
+            self.assertAlmostEqual(properties['stddev'], values.std(),
+                                   places=4)
+            self.assertEqual(properties['min'], values.min())
+            self.assertEqual(properties['max'], values.max())
+
+    def test_zonalstats_selection(self):
+        """
+        Test computing a selection of zonal statistics with percentiles
+        """
+        from gaia.geo.gdal_functions import gdal_zonalstats
+        random = numpy.random.RandomState(2)
+        array = (random.rand(100, 100) * 1000).astype('float32')
+        geotransform = (10.0, 0.1, 0, 20.0, 0, -0.1)
+        raster = mem_raster(array, geotransform)
+        windows = [(0, 0, 7, 5), (10, 10, 90, 60), (50, 70, 51, 71)]
+        zones = json.dumps(zone_rectangles(windows, geotransform))
+        stats = ['count', 'median', 'percentile_10', 'percentile_50',
+                 'percentile_97.5']
+
+        for engine in ('batched', 'feature'):
+            features = gdal_zonalstats(zones, raster, engine=engine,
+                                       stats=stats)
+            for window, feature in zip(windows, features):
+                properties = feature['properties']
+                values = window_values(array, window)
+                self.assertEqual(sorted(properties), sorted(stats))
+                self.assertEqual(properties['count'], len(values))
+                self.assertAlmostEqual(properties['median'],
+                                       numpy.median(values), places=3)
+                for q in (10, 50, 97.5):
+                    self.assertAlmostEqual(
+                        properties['percentile_{}'.format(q)],
+                        numpy.percentile(values, q), places=3)
+
+    def test_dispatch(self):
+        """
+        Test that only the crop processes for the input types are tried
+        """
+        vector = gaia.create(
+            os.path.join(testfile_path, 'baghdad_districts.geojson'))
+        raster = gaia.create(
+            os.path.join(testfile_path, 'globalairtemp.tif'))
+
+        self.assertEqual(dispatch('crop', [raster, vector]),
+                         [compute_subset_gdal])
+        self.assertEqual(dispatch('crop', [vector, vector]), [crop_pandas])
+        self.assertIsNone(vector._data)
+        self.assertIsNone(raster._data)